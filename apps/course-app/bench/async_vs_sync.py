@@ -0,0 +1,120 @@
+"""Throughput and tail latency of the async store path vs the threaded (sync) path.
+
+Starts the app under uvicorn twice -- APP_ASYNC_STORE=true and false -- and
+drives it with N concurrent keep-alive connections for a fixed duration.
+Store settings (APP_STORE, APP_REDIS_URL, ...) are taken from the environment.
+SQLite is refused: it has no async client, so both modes run the same
+threaded path and the numbers would only show noise.
+
+Usage (from apps/course-app):
+    APP_STORE=redis python bench/async_vs_sync.py --concurrency 1000 --duration 15 --path /api/messages?limit=50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+async def wait_ready(base: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as c:
+        while time.monotonic() < deadline:
+            try:
+                if (await c.get(f"{base}/readyz")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("app did not become ready")
+
+
+async def load(base: str, path: str, concurrency: int, duration: float) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=30.0) as c:
+        stop = time.monotonic() + duration
+
+        async def worker() -> None:
+            nonlocal errors
+            while time.monotonic() < stop:
+                t0 = time.perf_counter()
+                try:
+                    r = await c.get(path)
+                    if r.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+    }
+
+
+def run_app(async_store: bool, port: int, db_dir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["APP_ASYNC_STORE"] = "true" if async_store else "false"
+    env.setdefault("APP_DB_PATH", os.path.join(db_dir, "bench.db"))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=env,
+    )
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, default=1000)
+    ap.add_argument("--duration", type=float, default=15.0)
+    ap.add_argument("--path", default="/api/messages?limit=50")
+    ap.add_argument("--port", type=int, default=18080)
+    args = ap.parse_args()
+
+    backend = os.getenv("APP_STORE", "sqlite").lower()
+    if os.getenv("APP_MESSAGES_API") or os.getenv("APP_COUNTER_API"):
+        backend = "http"
+    if backend not in ("redis", "http", "memory"):
+        raise SystemExit(
+            f"APP_STORE={backend}: both modes use the same threaded store path, nothing to compare;"
+            " run with APP_STORE=redis, APP_STORE=http (APP_MESSAGES_API/APP_COUNTER_API) or APP_STORE=memory"
+        )
+
+    base = f"http://127.0.0.1:{args.port}"
+    print(f"backend: {backend}")
+    print(f"{'mode':>6} {'req/s':>9} {'p50':>9} {'p99':>9} {'errors':>7}")
+    with tempfile.TemporaryDirectory() as db_dir:
+        for async_store in (False, True):
+            proc = run_app(async_store, args.port, db_dir)
+            try:
+                await wait_ready(base)
+                res = await load(base, args.path, args.concurrency, args.duration)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=10)
+            mode = "async" if async_store else "sync"
+            print(
+                f"{mode:>6} {res['rps']:>9.1f} {res['p50_ms']:>7.1f}ms"
+                f" {res['p99_ms']:>7.1f}ms {res['errors']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Microbenchmark for RedisStore.list_messages at typical page sizes.
+
+Compares the scripted single-round-trip read against the previous
+LRANGE + HGETALL-per-id loop.
+
+Usage (from apps/course-app):
+    python bench/redis_messages.py --url redis://localhost:6379/15
+    python bench/redis_messages.py --fake   # in-process fakeredis, no network
+
+The target database is flushed, so point it at a scratch db.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.main import RedisStore  # noqa: E402
+
+
+def naive_list(store: RedisStore, limit: int) -> List[Dict[str, Any]]:
+    ids = store.client.lrange("messages:ids", 0, max(0, limit - 1))
+    items = []
+    for s in ids:
+        data = store.client.hgetall(f"message:{int(s)}")
+        if data:
+            items.append(data)
+    return items
+
+
+def measure(fn, limit: int, iterations: int) -> Dict[str, float]:
+    fn(limit)  # warm up (script load, connection)
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn(limit)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    return {
+        "p50_ms": statistics.median(samples),
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default=os.getenv("APP_REDIS_URL", "redis://localhost:6379/15"))
+    ap.add_argument("--fake", action="store_true", help="use fakeredis instead of a server")
+    ap.add_argument("--messages", type=int, default=1000)
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--limits", default="20,50,500")
+    args = ap.parse_args()
+
+    store = RedisStore(args.url)
+    if args.fake:
+        import fakeredis  # type: ignore
+
+        store.client = fakeredis.FakeRedis(decode_responses=True)
+        store._add_message = store.client.register_script(store._add_message.script)
+        store._list_messages = store.client.register_script(store._list_messages.script)
+    store.client.flushdb()
+    store.init()
+    for i in range(args.messages):
+        store.add_message(f"message {i}")
+
+    print(f"{'limit':>6} {'scripted p50':>13} {'p99':>8} {'naive p50':>10} {'p99':>8}")
+    for limit in (int(x) for x in args.limits.split(",")):
+        new = measure(lambda n: store.list_messages(limit=n), limit, args.iterations)
+        old = measure(lambda n: naive_list(store, n), limit, args.iterations)
+        print(
+            f"{limit:>6} {new['p50_ms']:>11.3f}ms {new['p99_ms']:>6.3f}ms"
+            f" {old['p50_ms']:>8.3f}ms {old['p99_ms']:>6.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
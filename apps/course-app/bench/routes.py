@@ -0,0 +1,119 @@
+"""End-to-end route benchmark that drives the FastAPI app in-process.
+
+Requests go through httpx.ASGITransport, so there are no sockets and the
+numbers cover routing, middleware, handlers, rendering and the store only.
+Each backend (see bench/stores.py) is measured with the app's pure ASGI
+middleware (X-Request-ID, Server-Timing, metrics), with the same request id
+handling done through @app.middleware("http") (BaseHTTPMiddleware, how the
+app did it before) and with no middleware at all.
+
+Usage (from apps/course-app):
+    python bench/routes.py --backends memory,sqlite,redis,http --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+
+from stores import app_main, open_backend  # noqa: E402
+
+ROUTES: List[Tuple[str, str, Dict[str, Any]]] = [
+    ("GET", "/", {}),
+    ("GET", "/api/messages?limit=50", {}),
+    ("POST", "/api/messages", {"data": {"text": "bench message"}}),
+    ("GET", "/api/counter/visits", {}),
+    ("GET", "/readyz", {}),
+    ("GET", "/api/info", {}),
+    ("GET", "/api/messages/export", {}),
+]
+
+MODES = ("asgi", "base", "off")
+
+
+async def base_http_request_id(request, call_next):
+    # the request id middleware as it was before the pure ASGI version
+    req_id = request.headers.get("x-request-id") or app_main.uuid.uuid4().hex[:12]
+    app_main.REQ_ID_CTX.set(req_id)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = req_id
+    return response
+
+
+def set_middleware(mode: str, original: list) -> None:
+    app = app_main.app
+    if mode == "asgi":
+        app.user_middleware = list(original)
+    elif mode == "base":
+        app.user_middleware = [Middleware(BaseHTTPMiddleware, dispatch=base_http_request_id)]
+    else:
+        app.user_middleware = []
+    app.middleware_stack = None  # rebuilt on the next request
+
+
+async def bench_route(
+    client: httpx.AsyncClient, method: str, path: str, kwargs: Dict[str, Any], requests: int, concurrency: int
+) -> Dict[str, float]:
+    latencies: List[float] = []
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            t0 = time.perf_counter()
+            r = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                raise RuntimeError(f"{method} {path}: {r.status_code} {r.text[:200]}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000.0,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000.0,
+    }
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backends", default="memory,sqlite,redis,http")
+    ap.add_argument("--requests", type=int, default=1000, help="requests per route")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--redis-url", default="")
+    args = ap.parse_args()
+
+    original = list(app_main.app.user_middleware)
+    transport = httpx.ASGITransport(app=app_main.app)
+    for name in args.backends.split(","):
+        async with open_backend(name, args) as backend:
+            app_main.store = backend
+            await backend.add_messages(["seed message"] * 100)
+            print(f"\n{name}")
+            print(f"{'route':>28} {'middleware':>10} {'req/s':>9} {'p50':>9} {'p99':>9}")
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for method, path, kwargs in ROUTES:
+                    for mode in MODES:
+                        set_middleware(mode, original)
+                        await client.request(method, path, **kwargs)  # warm up
+                        r = await bench_route(client, method, path, kwargs, args.requests, args.concurrency)
+                        print(
+                            f"{method + ' ' + path:>28} {mode:>10} {r['rps']:>9.0f}"
+                            f" {r['p50_ms']:>7.3f}ms {r['p99_ms']:>7.3f}ms"
+                        )
+    set_middleware("asgi", original)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
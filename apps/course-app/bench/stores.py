@@ -0,0 +1,260 @@
+"""Store-level benchmark for every backend, runnable offline.
+
+Runs each AsyncStore operation with N concurrent callers and reports ops/s,
+p50, p95 and p99. Backends:
+
+  memory  MemoryStore, the floor every other backend is compared to
+  sqlite  temporary database file
+  redis   --redis-url if given, else a local `redis-server` on a free port,
+          else in-process fakeredis
+  http    AsyncHttpStore against an in-process ASGI stub of the
+          messages/counter services (no sockets)
+
+Usage (from apps/course-app):
+    python bench/stores.py --backends memory,sqlite,redis,http --concurrency 32 --out results.json
+    python bench/stores.py --baseline results.json --threshold 2.0
+
+Each operation runs --repeat times and the median of every metric is kept.
+With --baseline the run exits non-zero if any operation's p50 or ops/s is
+more than --threshold times worse than in the baseline file and also worse by
+more than --min-delta-ms per call, so sub-microsecond operations (memory.ping
+going from 0.000 to 0.001 ms) cannot fail the gate on noise.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI, Form, Request  # noqa: E402
+
+import src.main as app_main  # noqa: E402
+
+
+def stub_services() -> FastAPI:
+    """Minimal in-memory stand-in for the messages and counter services."""
+    stub = FastAPI()
+    counters: Dict[str, int] = {}
+    messages: List[Dict[str, Any]] = []
+
+    @stub.get("/api/counter/{name}")
+    async def get_counter(name: str):
+        return {"name": name, "value": counters.get(name, 0)}
+
+    @stub.post("/api/counter/{name}/incr")
+    async def incr_counter(name: str, delta: int = 1):
+        counters[name] = counters.get(name, 0) + delta
+        return {"name": name, "value": counters[name]}
+
+    def _add(text: str) -> int:
+        msg_id = len(messages) + 1
+        messages.append({"id": msg_id, "text": text, "created_at": ""})
+        return msg_id
+
+    @stub.post("/api/messages")
+    async def add_message(text: str = Form(...)):
+        _add(text)
+        return {"status": "created"}
+
+    @stub.post("/api/messages/batch")
+    async def add_messages(request: Request):
+        return {"status": "created", "ids": [_add(t) for t in await request.json()]}
+
+    @stub.get("/api/messages")
+    async def list_messages(limit: int = 20, before_id: int | None = None, after_id: int | None = None):
+        # ids are 1-based list positions
+        if after_id is not None:
+            page = messages[after_id:after_id + limit]
+        else:
+            end = len(messages) if before_id is None else max(0, min(before_id - 1, len(messages)))
+            page = messages[max(0, end - limit):end]
+        return {"items": list(reversed(page))}
+
+    return stub
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def open_backend(name: str, args: argparse.Namespace) -> AsyncIterator[app_main.AsyncStore]:
+    proc = None
+    tmp = tempfile.mkdtemp()
+    try:
+        if name == "memory":
+            store: app_main.AsyncStore = app_main.InlineAsyncStore(app_main.MemoryStore())
+        elif name == "sqlite":
+            store = app_main.ThreadedAsyncStore(
+                app_main.SqliteStore(os.path.join(tmp, "bench.db"))
+            )
+        elif name == "redis":
+            url = args.redis_url
+            if not url and shutil.which("redis-server"):
+                port = _free_port()
+                proc = subprocess.Popen(
+                    ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+                    stdout=subprocess.DEVNULL,
+                )
+                url = f"redis://127.0.0.1:{port}/0"
+                await asyncio.sleep(0.3)
+            store = app_main.AsyncRedisStore(url or "redis://localhost:6379/0")
+            if not url:
+                import fakeredis  # type: ignore
+
+                store.client = fakeredis.FakeAsyncRedis(decode_responses=True)
+                for attr in (
+                    "_add_message", "_add_messages", "_list_messages", "_trim_messages",
+                    "_backfill_search", "_search_messages",
+                ):
+                    setattr(store, attr, store.client.register_script(getattr(store, attr).script))
+            await store.client.flushdb()
+        elif name == "http":
+            store = app_main.AsyncHttpStore("http://messages/api", "http://counter/api")
+            transport = httpx.ASGITransport(app=stub_services())
+            for client in (store.messages_client, store.counter_client):
+                client._transport = transport
+        else:
+            raise SystemExit(f"unknown backend {name!r}")
+        await store.init()
+        try:
+            yield store
+        finally:
+            await store.close()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+async def run_op(fn: Callable[[], Any], concurrency: int, operations: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    remaining = operations
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            t0 = time.perf_counter()
+            await fn()
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000.0
+
+    return {
+        "ops_per_s": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000.0,
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+async def bench_backend(store: app_main.AsyncStore, args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    text = "x" * args.payload
+    batch = [text] * args.batch
+    # seed enough rows for list_messages to read full pages
+    await store.add_messages([text] * max(args.limit, 1000))
+    ops: Dict[str, Callable[[], Any]] = {
+        "ping": store.ping,
+        "get_counter": lambda: store.get_counter("visits"),
+        "incr_counter": lambda: store.incr_counter("visits", 1),
+        "add_message": lambda: store.add_message(text),
+        "add_messages": lambda: store.add_messages(batch),
+        "list_messages": lambda: store.list_messages(limit=args.limit),
+    }
+    results = {}
+    for op, fn in ops.items():
+        await fn()  # warm up
+        n = args.operations // args.batch if op == "add_messages" else args.operations
+        runs = [await run_op(fn, args.concurrency, max(n, args.concurrency)) for _ in range(max(1, args.repeat))]
+        results[op] = {metric: statistics.median(r[metric] for r in runs) for metric in runs[0]}
+    return results
+
+
+def check_regressions(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta_ms: float
+) -> List[str]:
+    failures = []
+    for backend, ops in results.items():
+        for op, cur in ops.items():
+            base = baseline.get(backend, {}).get(op)
+            if not base:
+                continue
+            if cur["p50_ms"] > base["p50_ms"] * threshold and cur["p50_ms"] - base["p50_ms"] > min_delta_ms:
+                failures.append(f"{backend}.{op}: p50 {base['p50_ms']:.3f}ms -> {cur['p50_ms']:.3f}ms")
+            # the same floor on throughput, as wall time per call
+            slower_ms = 1000.0 / cur["ops_per_s"] - 1000.0 / base["ops_per_s"]
+            if cur["ops_per_s"] * threshold < base["ops_per_s"] and slower_ms > min_delta_ms:
+                failures.append(f"{backend}.{op}: {base['ops_per_s']:.0f} -> {cur['ops_per_s']:.0f} ops/s")
+    return failures
+
+
+async def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backends", default="memory,sqlite,redis,http")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--operations", type=int, default=2000, help="calls per operation")
+    ap.add_argument("--payload", type=int, default=64, help="message size in bytes")
+    ap.add_argument("--limit", type=int, default=50, help="list_messages page size")
+    ap.add_argument("--batch", type=int, default=100, help="texts per add_messages call")
+    ap.add_argument("--redis-url", default="")
+    ap.add_argument("--out", help="write results as JSON")
+    ap.add_argument("--baseline", help="JSON results to compare against")
+    ap.add_argument("--threshold", type=float, default=2.0)
+    ap.add_argument(
+        "--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this per call"
+    )
+    ap.add_argument("--repeat", type=int, default=3, help="runs per operation; the median is reported")
+    args = ap.parse_args()
+
+    results: Dict[str, Any] = {}
+    for name in args.backends.split(","):
+        async with open_backend(name, args) as store:
+            results[name] = await bench_backend(store, args)
+        print(f"\n{name}")
+        print(f"{'operation':>14} {'ops/s':>10} {'p50':>9} {'p95':>9} {'p99':>9} {'p50 vs memory':>14}")
+        for op, r in results[name].items():
+            floor = results.get("memory", {}).get(op)
+            ratio = f"{r['p50_ms'] / floor['p50_ms']:>13.1f}x" if floor and floor["p50_ms"] else f"{'-':>14}"
+            print(
+                f"{op:>14} {r['ops_per_s']:>10.0f} {r['p50_ms']:>7.3f}ms"
+                f" {r['p95_ms']:>7.3f}ms {r['p99_ms']:>7.3f}ms {ratio}"
+            )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check_regressions(results, json.load(f), args.threshold, args.min_delta_ms)
+        if failures:
+            print(f"\nREGRESSION (>{args.threshold}x and >{args.min_delta_ms}ms worse than {args.baseline}):")
+            for line in failures:
+                print(f"  {line}")
+            return 1
+        print(f"\nno regressions beyond {args.threshold}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,26 +1,63 @@
 import os
+import sys
+import signal
+import argparse
 import socket
 import time
 import math
+import random
+import asyncio
 import threading
+import multiprocessing
+import concurrent.futures
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-
-from fastapi import FastAPI, HTTPException, Form, Query, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+import queue
+import heapq
+import array
+import pathlib
+import hashlib
+import gzip
+import io
+import csv
+import json
+import re
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Set, Tuple
+
+import anyio
+from fastapi import FastAPI, HTTPException, Form, Query, Request, WebSocket
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.datastructures import MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
 
 try:
     import redis  # type: ignore
+    import redis.asyncio as aioredis  # type: ignore
 except Exception:  # pragma: no cover - optional dependency for sqlite-only use
     redis = None
+    aioredis = None
 try:
     import httpx  # type: ignore
 except Exception:  # pragma: no cover - optional dependency for non-http use
     httpx = None
+try:
+    import prometheus_client  # type: ignore
+except Exception:  # pragma: no cover - optional dependency for /metrics
+    prometheus_client = None
+try:
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover - optional dependency for precompressed assets
+    brotli = None
 import uuid
 import contextvars
 
+try:
+    from . import stress  # uvicorn src.main:app
+except ImportError:
+    import stress  # python src/main.py
+
 
 APP_MESSAGE = os.getenv("APP_MESSAGE", "Welcome to the Course App")
 SECRET_TOKEN = os.getenv("APP_SECRET_TOKEN", "")
@@ -29,11 +66,102 @@ DB_PATH = os.getenv("APP_DB_PATH", "data/data.sql")
 REDIS_URL = os.getenv("APP_REDIS_URL", "redis://localhost:6379/0")
 MESSAGES_API = os.getenv("APP_MESSAGES_API", "").rstrip("/")
 COUNTER_API = os.getenv("APP_COUNTER_API", "").rstrip("/")
+SQLITE_POOL_SIZE = int(os.getenv("APP_SQLITE_POOL_SIZE", "8"))
+SQLITE_SYNCHRONOUS = os.getenv("APP_SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_MMAP_SIZE = int(os.getenv("APP_SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("APP_SQLITE_CACHE_SIZE", "-16000"))  # negative = KiB
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("APP_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+COUNTER_FLUSH_MS = int(os.getenv("APP_COUNTER_FLUSH_MS", "0"))  # 0 = write-through
+COUNTER_FLUSH_MAX = int(os.getenv("APP_COUNTER_FLUSH_MAX", "1000"))
+# "visits=16,likes=4": spread hot counters over N keys/rows, summed on read
+COUNTER_SHARDS = {
+    name.strip(): max(1, int(n))
+    for name, _, n in (item.partition("=") for item in os.getenv("APP_COUNTER_SHARDS", "").split(","))
+    if name.strip() and n.strip()
+}
+HTTP_MAX_CONNECTIONS = int(os.getenv("APP_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("APP_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("APP_HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("APP_HTTP_CONNECT_TIMEOUT", "1.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("APP_HTTP_READ_TIMEOUT", "3.0"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("APP_HTTP_WRITE_TIMEOUT", "3.0"))
+HTTP_PING_TIMEOUT = float(os.getenv("APP_HTTP_PING_TIMEOUT", "2.0"))
+HTTP2 = os.getenv("APP_HTTP2", "false").lower() in ("1", "true", "yes")
+HTTP_BREAKER_FAILURES = int(os.getenv("APP_HTTP_BREAKER_FAILURES", "5"))  # 0 = no breaker
+HTTP_BREAKER_RESET_S = float(os.getenv("APP_HTTP_BREAKER_RESET_S", "10"))
+HTTP_COALESCE = os.getenv("APP_HTTP_COALESCE", "true").lower() in ("1", "true", "yes")
+HTTP_READ_RETRIES = int(os.getenv("APP_HTTP_READ_RETRIES", "2"))
+HTTP_RETRY_BACKOFF_MS = int(os.getenv("APP_HTTP_RETRY_BACKOFF_MS", "50"))
+HTTP_RETRY_BUDGET = float(os.getenv("APP_HTTP_RETRY_BUDGET", "0.1"))  # extra attempts per read
+HTTP_RETRY_BURST = int(os.getenv("APP_HTTP_RETRY_BURST", "10"))
+HTTP_HEDGE = os.getenv("APP_HTTP_HEDGE", "false").lower() in ("1", "true", "yes")
+HTTP_HEDGE_MIN_MS = int(os.getenv("APP_HTTP_HEDGE_MIN_MS", "10"))
+ASYNC_STORE = os.getenv("APP_ASYNC_STORE", "true").lower() in ("1", "true", "yes")
+# one thread per SQLite connection: more threads would only queue on the pool
+STORE_THREADS = int(os.getenv("APP_STORE_THREADS", str(SQLITE_POOL_SIZE)))
+MEMORY_MAX_MESSAGES = int(os.getenv("APP_MEMORY_MAX_MESSAGES", "100000"))
+MEMORY_SNAPSHOT_PATH = os.getenv("APP_MEMORY_SNAPSHOT_PATH", "")  # "" = no snapshots
+MEMORY_SNAPSHOT_S = float(os.getenv("APP_MEMORY_SNAPSHOT_S", "30"))
+MAX_PAGE_SIZE = int(os.getenv("APP_MAX_PAGE_SIZE", "200"))
+MESSAGES_CACHE_TTL_MS = int(os.getenv("APP_MESSAGES_CACHE_TTL_MS", "0"))  # 0 = no cache
+MESSAGES_CACHE_SIZE = int(os.getenv("APP_MESSAGES_CACHE_SIZE", "256"))
+EXPORT_BATCH_SIZE = int(os.getenv("APP_EXPORT_BATCH_SIZE", "1000"))
+MAX_BATCH_SIZE = int(os.getenv("APP_MAX_BATCH_SIZE", "50000"))
+COMPRESS_MIN_BYTES = int(os.getenv("APP_COMPRESS_MIN_BYTES", "1024"))  # 0 = off
+RETENTION_MAX_MESSAGES = int(os.getenv("APP_RETENTION_MAX_MESSAGES", "0"))  # 0 = keep all
+RETENTION_MAX_AGE_S = float(os.getenv("APP_RETENTION_MAX_AGE_S", "0"))  # 0 = keep all
+COMPACTION_INTERVAL_S = float(os.getenv("APP_COMPACTION_INTERVAL_S", "60"))
+COMPACTION_BATCH = int(os.getenv("APP_COMPACTION_BATCH", "1000"))
+SEARCH_BACKFILL_BATCH = int(os.getenv("APP_SEARCH_BACKFILL_BATCH", "1000"))
+STREAM_QUEUE_SIZE = int(os.getenv("APP_STREAM_QUEUE_SIZE", "256"))
+STREAM_MAX_SUBSCRIBERS = int(os.getenv("APP_STREAM_MAX_SUBSCRIBERS", "1000"))
+STREAM_POLL_S = float(os.getenv("APP_STREAM_POLL_S", "2"))  # 0 = local writes only
+STREAM_HEARTBEAT_S = float(os.getenv("APP_STREAM_HEARTBEAT_S", "15"))
+STRESS_MAX_JOBS = int(os.getenv("APP_STRESS_MAX_JOBS", "4"))
+STRESS_MAX_SECONDS = int(os.getenv("APP_STRESS_MAX_SECONDS", "120"))
+STRESS_MAX_MB = int(os.getenv("APP_STRESS_MAX_MB", "2048"))
+METRICS_ENABLED = prometheus_client is not None and os.getenv("APP_METRICS", "true").lower() in ("1", "true", "yes")
+SERVER_TIMING = os.getenv("APP_SERVER_TIMING", "true").lower() in ("1", "true", "yes")
 HOSTNAME = socket.gethostname()
 REQ_ID_CTX: contextvars.ContextVar[str] = contextvars.ContextVar("req_id", default="")
+# seconds spent in store calls by the current request (Server-Timing)
+REQ_TIMING_CTX: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("req_timing", default=None)
+# set by serve(): the schema was created once before the workers were forked,
+# so their init() only does per-process setup
+STORE_SCHEMA_READY = False
+WORKER_ID = 0  # serve() worker slot; slot 0 runs the per-pod background jobs
+
+
+def counter_shard_key(name: str) -> str:
+    # the key a single increment lands on; shard 0 is the plain key, so
+    # counters written before sharding keep counting
+    shards = COUNTER_SHARDS.get(name, 1)
+    if shards <= 1:
+        return name
+    i = random.randrange(shards)
+    return f"{name}#{i}" if i else name
+
+
+SEARCH_TOKEN_RE = re.compile(r"\w+")
+
+
+def search_tokens(text: str) -> List[str]:
+    # lowercased word tokens; the same split is used for indexing and for queries
+    return [t.lower() for t in SEARCH_TOKEN_RE.findall(text)]
+
+
+def _query_tokens(query: str) -> List[str]:
+    # distinct tokens in query order; every one of them has to match
+    return list(dict.fromkeys(search_tokens(query)))
 
 
 class Store:
+    """Blocking storage backend.
+
+    list_messages() pages newest first: `before_id` returns the `limit` messages
+    older than that id, `after_id` the `limit` messages right after it.
+    """
+
     name = "base"
 
     def init(self) -> None:
@@ -48,25 +176,241 @@ class Store:
     def incr_counter(self, name: str, delta: int = 1) -> int:
         raise NotImplementedError
 
+    def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        # batched increment; backends override this to use a single write
+        return {name: self.incr_counter(name, delta) for name, delta in deltas.items()}
+
     def add_message(self, text: str) -> None:
         raise NotImplementedError
 
-    def list_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
+    def add_messages(self, texts: List[str]) -> List[int]:
+        # batched insert; returns the assigned ids in input order
         raise NotImplementedError
 
+    def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def messages_version(self) -> Optional[str]:
+        # cheap token that changes whenever list_messages() results may;
+        # None when the backend has none
+        return None
+
+    def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        # delete up to `batch` of the oldest messages beyond `max_count` or older
+        # than `max_age_s` (0 = no limit); returns how many went. No-op by default
+        return 0
+
+    def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        # messages containing every word of `query`, best match first, each with a "score"
+        raise NotImplementedError
+
+    def backfill_search(self, batch: int) -> int:
+        # index up to `batch` messages written before the search index existed;
+        # returns 0 once there is nothing left
+        return 0
+
+    def close(self) -> None:
+        # release pooled resources on shutdown; no-op by default
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        # runtime counters for /api/info
+        return {}
+
+
+class AsyncStore:
+    """Async counterpart of Store; this is what the route handlers await."""
+
+    name = "base"
+
+    async def init(self) -> None:
+        raise NotImplementedError
+
+    async def ping(self) -> None:
+        raise NotImplementedError
+
+    async def get_counter(self, name: str) -> int:
+        raise NotImplementedError
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        raise NotImplementedError
+
+    async def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        return {name: await self.incr_counter(name, delta) for name, delta in deltas.items()}
+
+    async def add_message(self, text: str) -> None:
+        raise NotImplementedError
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        raise NotImplementedError
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def messages_version(self) -> Optional[str]:
+        return None
+
+    async def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        return 0
+
+    async def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def backfill_search(self, batch: int) -> int:
+        return 0
+
+    async def close(self) -> None:
+        pass
+
+    async def export_messages(self, batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        # oldest first, one keyset page at a time so memory stays flat
+        after_id = 0
+        while True:
+            page = await self.list_messages(limit=batch_size, after_id=after_id)
+            if not page:
+                return
+            page.reverse()
+            yield page
+            after_id = page[-1]["id"]
+
+    def export_stream(self, fmt: str) -> Optional[AsyncIterator[bytes]]:
+        # already-encoded export body when the backend can pass one through
+        return None
+
+    def message_events(self) -> Optional[AsyncIterator[int]]:
+        # ids of messages added by any writer, including other pods;
+        # None when the backend cannot push them
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        # runtime counters for /api/info
+        return {}
+
+
+class SqlitePool:
+    """Bounded pool of sqlite3 connections.
+
+    A connection is checked out by one thread at a time and returned LIFO, so in
+    the steady state each worker thread keeps reusing a warm connection instead
+    of paying connect/close (and schema load) per request.
+    """
+
+    def __init__(self, path: str, size: int, readonly: bool = False, pragmas: Optional[Dict[str, Any]] = None) -> None:
+        self.path = path
+        self.size = max(1, size)
+        self.readonly = readonly
+        self.pragmas = pragmas or {}
+        self.timeout = SQLITE_BUSY_TIMEOUT_MS / 1000.0
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.readonly:
+            uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        for key, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {key}={value}")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("sqlite connection pool exhausted")
+        conn: Optional[sqlite3.Connection] = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    # connection is unusable, drop it instead of returning it
+                    conn.close()
+                    conn = None
+                raise
+        finally:
+            if conn is not None:
+                if self._closed:
+                    conn.close()
+                else:
+                    self._idle.put(conn)
+            self._slots.release()
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# external-content FTS5 index over messages.text. Rows that existed before the
+# index was added are indexed by backfill_search(); until that reaches them the
+# delete/update triggers must leave them alone, hence the WHEN clauses.
+SQLITE_FTS_INDEXED = (
+    "old.id <= (SELECT value FROM meta WHERE key = 'fts_backfilled_id') "
+    "OR old.id > (SELECT value FROM meta WHERE key = 'fts_backfill_until')"
+)
+SQLITE_FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages WHEN {SQLITE_FTS_INDEXED} BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text ON messages WHEN {SQLITE_FTS_INDEXED} BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+]
+
 
 class SqliteStore(Store):
     name = "sqlite"
 
     def __init__(self, path: str) -> None:
         self.path = path
+        pragmas = {
+            "synchronous": SQLITE_SYNCHRONOUS,
+            "mmap_size": SQLITE_MMAP_SIZE,
+            "cache_size": SQLITE_CACHE_SIZE,
+            "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        }
+        # WAL lets the read-only connections run while a writer holds the lock
+        self.writers = SqlitePool(path, SQLITE_POOL_SIZE, pragmas=pragmas)
+        self.readers = SqlitePool(path, SQLITE_POOL_SIZE, readonly=True, pragmas=pragmas)
+        self.search_backfill_pending = 0
 
     def init(self) -> None:
+        if not STORE_SCHEMA_READY:
+            self._create_schema()
+        with self.readers.connection() as conn:
+            cur = conn.cursor()
+            self.incremental_vacuum = cur.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+            done, until = self._backfill_range(cur)
+            self.search_backfill_pending = until - done
+
+    def _create_schema(self) -> None:
         dirpath = os.path.dirname(self.path) or "."
         os.makedirs(dirpath, exist_ok=True)
-        conn = sqlite3.connect(self.path)
-        try:
+        with self.writers.connection() as conn:
             cur = conn.cursor()
+            # only takes effect on a new database; existing ones keep their mode
+            # until a one-off VACUUM, and compaction then just leaves free pages
+            # to be reused by later inserts
+            cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # journal_mode is persistent in the database file, so set it once here
+            cur.execute("PRAGMA journal_mode=WAL")
             cur.execute(
                 "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER)"
             )
@@ -74,65 +418,483 @@ class SqliteStore(Store):
                 "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, created_at TEXT NOT NULL)"
             )
             cur.execute("INSERT OR IGNORE INTO counters(key, value) VALUES('visits', 0)")
+            cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+            # first run with the search index: everything up to the current max id
+            # is left to the backfill, everything after it to the triggers; both
+            # are decided in this one write transaction
+            cur.execute(
+                "INSERT OR IGNORE INTO meta(key, value) "
+                "VALUES('fts_backfill_until', (SELECT COALESCE(MAX(id), 0) FROM messages))"
+            )
+            cur.execute("INSERT OR IGNORE INTO meta(key, value) VALUES('fts_backfilled_id', 0)")
+            for statement in SQLITE_FTS_SCHEMA:
+                cur.execute(statement)
             conn.commit()
-        finally:
-            conn.close()
 
     def ping(self) -> None:
-        conn = sqlite3.connect(self.path)
-        try:
+        with self.readers.connection() as conn:
             cur = conn.cursor()
             cur.execute("SELECT 1")
             cur.fetchone()
-        finally:
-            conn.close()
+
+    # the plain row plus any "name#i" shard rows; a primary-key range scan, so
+    # rows left behind by a lowered shard count are still summed
+    COUNTER_SUM_SQL = "SELECT COALESCE(SUM(value), 0) FROM counters WHERE key=? OR (key > ? AND key < ?)"
+
+    @staticmethod
+    def _counter_sum_args(name: str) -> tuple:
+        return (name, f"{name}#", f"{name}$")
 
     def get_counter(self, name: str) -> int:
-        conn = sqlite3.connect(self.path)
-        try:
+        with self.readers.connection() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT value FROM counters WHERE key=?", (name,))
-            row = cur.fetchone()
-            return int(row[0]) if row else 0
-        finally:
-            conn.close()
+            cur.execute(self.COUNTER_SUM_SQL, self._counter_sum_args(name))
+            return int(cur.fetchone()[0])
 
     def incr_counter(self, name: str, delta: int = 1) -> int:
-        conn = sqlite3.connect(self.path)
-        try:
+        key = counter_shard_key(name)
+        with self.writers.connection() as conn:
             cur = conn.cursor()
-            cur.execute("UPDATE counters SET value = value + ? WHERE key=?", (delta, name))
+            cur.execute("UPDATE counters SET value = value + ? WHERE key=?", (delta, key))
             if cur.rowcount == 0:
-                cur.execute("INSERT INTO counters(key, value) VALUES(?, ?)", (name, delta))
+                cur.execute("INSERT INTO counters(key, value) VALUES(?, ?)", (key, delta))
+            cur.execute(self.COUNTER_SUM_SQL, self._counter_sum_args(name))
+            value = int(cur.fetchone()[0])
             conn.commit()
-            cur.execute("SELECT value FROM counters WHERE key=?", (name,))
-            return int(cur.fetchone()[0])
-        finally:
-            conn.close()
+            return value
+
+    def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        with self.writers.connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                "INSERT INTO counters(key, value) VALUES(?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                [(counter_shard_key(name), delta) for name, delta in deltas.items()],
+            )
+            for name in deltas:
+                cur.execute(self.COUNTER_SUM_SQL, self._counter_sum_args(name))
+                out[name] = int(cur.fetchone()[0])
+            conn.commit()
+        return out
 
     def add_message(self, text: str) -> None:
-        conn = sqlite3.connect(self.path)
-        try:
+        with self.writers.connection() as conn:
             cur = conn.cursor()
             cur.execute(
                 "INSERT INTO messages(text, created_at) VALUES(?, ?)", (text, datetime.utcnow().isoformat())
             )
             conn.commit()
-        finally:
-            conn.close()
 
-    def list_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
-        conn = sqlite3.connect(self.path)
-        try:
+    def add_messages(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        created_at = datetime.utcnow().isoformat()
+        with self.writers.connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                "SELECT id, text, created_at FROM messages ORDER BY id DESC LIMIT ?",
-                (limit,),
+            cur.executemany(
+                "INSERT INTO messages(text, created_at) VALUES(?, ?)", ((t, created_at) for t in texts)
             )
+            # one transaction holds the write lock, so the new ids are consecutive
+            cur.execute("SELECT last_insert_rowid()")
+            last = int(cur.fetchone()[0])
+            conn.commit()
+        return list(range(last - len(texts) + 1, last + 1))
+
+    def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        with self.readers.connection() as conn:
+            cur = conn.cursor()
+            # keyset pagination over the INTEGER PRIMARY KEY (rowid) index
+            if after_id is not None:
+                cur.execute(
+                    "SELECT id, text, created_at FROM "
+                    "(SELECT id, text, created_at FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?) "
+                    "ORDER BY id DESC",
+                    (after_id, limit),
+                )
+            elif before_id is not None:
+                cur.execute(
+                    "SELECT id, text, created_at FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?",
+                    (before_id, limit),
+                )
+            else:
+                cur.execute(
+                    "SELECT id, text, created_at FROM messages ORDER BY id DESC LIMIT ?",
+                    (limit,),
+                )
             rows = cur.fetchall()
             return [{"id": r[0], "text": r[1], "created_at": r[2]} for r in rows]
-        finally:
-            conn.close()
+
+    def messages_version(self) -> Optional[str]:
+        # messages are only appended and compacted from the oldest end, so the
+        # two ends of the rowid index identify the table's state; each is a
+        # single index seek, unlike COUNT(*)
+        with self.readers.connection() as conn:
+            lo, hi = conn.execute(
+                "SELECT (SELECT MIN(id) FROM messages), (SELECT MAX(id) FROM messages)"
+            ).fetchone()
+        return f"{lo or 0}-{hi or 0}"
+
+    def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        # find the newest id that has to go on a reader, then delete one batch
+        # up to it, so the write lock is held for a bounded DELETE only
+        floor = 0
+        with self.readers.connection() as conn:
+            cur = conn.cursor()
+            if max_count > 0:
+                # AUTOINCREMENT ids only ever lose rows from the old end (here), so
+                # the newest max_count are the ids above MAX(id) - max_count: one
+                # index lookup instead of an OFFSET walk over max_count rows
+                cur.execute("SELECT MAX(id) FROM messages")
+                floor = max(0, (cur.fetchone()[0] or 0) - max_count)
+            cutoff = _retention_cutoff(max_age_s)
+            if cutoff:
+                # ids grow with created_at, so only the oldest batch has to be checked
+                cur.execute(
+                    "SELECT MAX(id) FROM (SELECT id, created_at FROM messages ORDER BY id ASC LIMIT ?) "
+                    "WHERE created_at < ?",
+                    (batch, cutoff),
+                )
+                floor = max(floor, cur.fetchone()[0] or 0)
+        if not floor:
+            return 0
+        with self.writers.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "DELETE FROM messages WHERE id IN (SELECT id FROM messages WHERE id <= ? ORDER BY id ASC LIMIT ?)",
+                (floor, batch),
+            )
+            deleted = cur.rowcount
+            conn.commit()
+            if self.incremental_vacuum:
+                # hand the pages freed by this batch back to the filesystem;
+                # executescript steps the pragma to completion (execute frees one page)
+                conn.executescript("PRAGMA incremental_vacuum;")
+        return deleted
+
+    @staticmethod
+    def _backfill_range(cur: sqlite3.Cursor) -> tuple:
+        cur.execute("SELECT key, value FROM meta WHERE key IN ('fts_backfilled_id', 'fts_backfill_until')")
+        meta = dict(cur.fetchall())
+        return meta["fts_backfilled_id"], meta["fts_backfill_until"]
+
+    def backfill_search(self, batch: int) -> int:
+        with self.writers.connection() as conn:
+            cur = conn.cursor()
+            done, until = self._backfill_range(cur)
+            if done >= until:
+                self.search_backfill_pending = 0
+                return 0
+            upto = min(until, done + max(1, batch))
+            cur.execute(
+                "INSERT INTO messages_fts(rowid, text) SELECT id, text FROM messages WHERE id > ? AND id <= ?",
+                (done, upto),
+            )
+            cur.execute("UPDATE meta SET value = ? WHERE key = 'fts_backfilled_id'", (upto,))
+            conn.commit()
+        self.search_backfill_pending = until - upto
+        return upto - done
+
+    def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        tokens = _query_tokens(query)
+        if not tokens:
+            return []
+        # quoted tokens, implicitly ANDed; user input never reaches the MATCH syntax
+        match = " ".join(f'"{t}"' for t in tokens)
+        with self.readers.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT m.id, m.text, m.created_at, -bm25(messages_fts) FROM messages_fts "
+                "JOIN messages m ON m.id = messages_fts.rowid "
+                "WHERE messages_fts MATCH ? ORDER BY rank, m.id DESC LIMIT ? OFFSET ?",
+                (match, max(1, limit), max(0, offset)),
+            )
+            return [
+                {"id": r[0], "text": r[1], "created_at": r[2], "score": round(r[3], 4)}
+                for r in cur.fetchall()
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"search_backfill_pending": self.search_backfill_pending}
+
+    def close(self) -> None:
+        self.writers.close()
+        self.readers.close()
+
+
+# the most shards each counter name was ever written with, so lowering or
+# removing APP_COUNTER_SHARDS still sums what the higher shards hold. No counter
+# key starts with counter-meta:, so no counter name can land on it. Read and
+# recorded every REDIS_SHARD_COUNTS_REFRESH_S, never per request.
+REDIS_SHARD_COUNTS_KEY = "counter-meta:shards"
+REDIS_SHARD_COUNTS_REFRESH_S = 30.0
+
+
+def _redis_counter_keys(name: str, shards: int) -> List[str]:
+    # shard 0 is the plain key, like counter_shard_key()
+    return [f"counters:{name}"] + [f"counters:{name}#{i}" for i in range(1, shards)]
+
+
+def _merge_shard_counts(recorded: Dict[str, str]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    # -> (shards to read per name, configured counts the record is missing)
+    counts = {name: int(n) for name, n in recorded.items()}
+    missing = {name: n for name, n in COUNTER_SHARDS.items() if n > counts.get(name, 1)}
+    counts.update(missing)
+    return counts, missing
+
+
+# pub/sub channel that carries the id of every new message
+REDIS_MESSAGES_CHANNEL = "messages:events"
+
+# Search index: one sorted set per token, search:{token}, member = message id,
+# score = term frequency plus a tiny recency part so equal matches list newest
+# first. A message's tokens are kept in its hash ("tok:tf tok:tf") so the trim
+# script can take it out of the index again.
+REDIS_INDEX_TOKENS_LUA = """
+local function index_tokens(id, tokens)
+    for token, tf in string.gmatch(tokens, '(%S+):(%d+)') do
+        redis.call('ZADD', 'search:' .. token, tonumber(tf) + id * 1e-12, id)
+    end
+end
+"""
+
+# KEYS: seq, ids list; ARGV: text, created_at, events channel, tokens -> new id
+REDIS_ADD_MESSAGE_LUA = REDIS_INDEX_TOKENS_LUA + """
+local id = redis.call('INCR', KEYS[1])
+redis.call('HSET', 'message:' .. id, 'id', id, 'text', ARGV[1], 'created_at', ARGV[2], 'tokens', ARGV[4])
+redis.call('LPUSH', KEYS[2], id)
+index_tokens(id, ARGV[4])
+redis.call('PUBLISH', ARGV[3], id)
+return id
+"""
+
+# KEYS: seq, ids list; ARGV: created_at, events channel, text, tokens, text,
+# tokens... -> first new id
+REDIS_ADD_MESSAGES_LUA = REDIS_INDEX_TOKENS_LUA + """
+local n = (#ARGV - 2) / 2
+local last = redis.call('INCRBY', KEYS[1], n)
+local first = last - n + 1
+for i = 1, n do
+    local id = first + i - 1
+    local tokens = ARGV[2 * i + 2]
+    redis.call('HSET', 'message:' .. id, 'id', id, 'text', ARGV[2 * i + 1], 'created_at', ARGV[1], 'tokens', tokens)
+    redis.call('LPUSH', KEYS[2], id)
+    index_tokens(id, tokens)
+    redis.call('PUBLISH', ARGV[2], id)
+end
+return first
+"""
+
+# KEYS: backfill cursor; ARGV: last id covered, id, tokens, id, tokens... -> 0.
+# Indexes messages written before the search index; ids whose hash is gone
+# (compacted meanwhile) are skipped instead of recreated.
+REDIS_BACKFILL_SEARCH_LUA = REDIS_INDEX_TOKENS_LUA + """
+for i = 2, #ARGV, 2 do
+    local id = ARGV[i]
+    if redis.call('EXISTS', 'message:' .. id) == 1 then
+        redis.call('HSET', 'message:' .. id, 'tokens', ARGV[i + 1])
+        index_tokens(tonumber(id), ARGV[i + 1])
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return 0
+"""
+
+# KEYS: seq, scratch key; ARGV: offset, limit, token... -> {{id, text,
+# created_at, score}, ...}, best first. Intersects the token sets weighted by
+# idf (log(1 + messages / sets size)); the scratch key only lives inside the
+# script.
+REDIS_SEARCH_MESSAGES_LUA = """
+local total = tonumber(redis.call('GET', KEYS[1]) or '0')
+local args = {KEYS[2], #ARGV - 2}
+local weights = {'WEIGHTS'}
+for i = 3, #ARGV do
+    local key = 'search:' .. ARGV[i]
+    local df = redis.call('ZCARD', key)
+    if df == 0 then
+        return {}
+    end
+    args[#args + 1] = key
+    weights[#weights + 1] = tostring(math.log(1 + total / df))
+end
+for _, w in ipairs(weights) do
+    args[#args + 1] = w
+end
+redis.call('ZINTERSTORE', unpack(args))
+local offset = tonumber(ARGV[1])
+local hits = redis.call('ZREVRANGE', KEYS[2], offset, offset + tonumber(ARGV[2]) - 1, 'WITHSCORES')
+redis.call('DEL', KEYS[2])
+local out = {}
+for i = 1, #hits, 2 do
+    local row = redis.call('HMGET', 'message:' .. hits[i], 'text', 'created_at')
+    if row[1] then
+        out[#out + 1] = {hits[i], row[1], row[2], hits[i + 1]}
+    end
+end
+return out
+"""
+
+# ZINTERSTORE destination for REDIS_SEARCH_MESSAGES_LUA. Outside search:*, where
+# every \w+ token has its own key (a "search:scratch" would be the word "scratch")
+REDIS_SEARCH_SCRATCH_KEY = "search-tmp"
+
+# texts per REDIS_ADD_MESSAGES_LUA call, so one script never blocks the server for long
+REDIS_BATCH_CHUNK = 1000
+
+# KEYS: ids list; ARGV: max count (0 = any), created_at cutoff ("" = none),
+# batch -> number of messages dropped from the old end, along with their
+# search index entries. Ids whose hash is gone (evicted) are dropped as well.
+REDIS_TRIM_MESSAGES_LUA = """
+local max_count = tonumber(ARGV[1])
+local batch = tonumber(ARGV[3])
+local over = 0
+if max_count > 0 then
+    over = math.max(0, redis.call('LLEN', KEYS[1]) - max_count)
+end
+local tail = redis.call('LRANGE', KEYS[1], -batch, -1)
+local drop = 0
+for i = #tail, 1, -1 do
+    local created_at = redis.call('HGET', 'message:' .. tail[i], 'created_at')
+    if drop < over or not created_at or (ARGV[2] ~= '' and created_at < ARGV[2]) then
+        drop = drop + 1
+    else
+        break
+    end
+end
+if drop == 0 then
+    return 0
+end
+local keys = {}
+for i = #tail - drop + 1, #tail do
+    local id = tail[i]
+    local tokens = redis.call('HGET', 'message:' .. id, 'tokens')
+    if tokens then
+        for token in string.gmatch(tokens, '(%S+):%d+') do
+            redis.call('ZREM', 'search:' .. token, id)
+        end
+    end
+    keys[#keys + 1] = 'message:' .. id
+end
+redis.call('UNLINK', unpack(keys))
+-- negative stop index: ids pushed at the head meanwhile are kept
+redis.call('LTRIM', KEYS[1], 0, -(drop + 1))
+return drop
+"""
+
+# KEYS: ids list; ARGV: limit, before_id, after_id ('' = unset)
+# -> {{id, text, created_at}, ...}, newest first; ids whose hash is gone
+# (evicted/expired) are skipped
+REDIS_LIST_MESSAGES_LUA = """
+local limit = tonumber(ARGV[1])
+local before = tonumber(ARGV[2])
+local after = tonumber(ARGV[3])
+local len = redis.call('LLEN', KEYS[1])
+-- list lookups walk from the nearer end, so address the older half from the tail
+local function index(pos)
+    if pos > len / 2 then
+        return pos - len
+    end
+    return pos
+end
+local function id_at(pos)
+    return tonumber(redis.call('LINDEX', KEYS[1], index(pos)))
+end
+-- ids are pushed in increasing order, so the list is sorted newest first.
+-- Returns the first offset whose id is below `bound`: ids are normally
+-- contiguous, so the guess from the head id is exact and costs two LINDEX
+-- calls; gaps fall back to a binary search.
+local function first_below(bound)
+    if len == 0 then
+        return 0
+    end
+    local guess = math.min(math.max(id_at(0) - bound + 1, 0), len)
+    if (guess == len or id_at(guess) < bound) and (guess == 0 or id_at(guess - 1) >= bound) then
+        return guess
+    end
+    local lo, hi = 0, len
+    while lo < hi do
+        local mid = math.floor((lo + hi) / 2)
+        if id_at(mid) < bound then
+            hi = mid
+        else
+            lo = mid + 1
+        end
+    end
+    return lo
+end
+local first, last = 0, limit - 1
+if before then
+    first = first_below(before)
+    last = first + limit - 1
+elseif after then
+    last = first_below(after + 1) - 1
+    first = math.max(0, last - limit + 1)
+end
+last = math.min(last, len - 1)
+if last < first then
+    return {}
+end
+local ids = redis.call('LRANGE', KEYS[1], index(first), index(last))
+local out = {}
+for _, id in ipairs(ids) do
+    local row = redis.call('HMGET', 'message:' .. id, 'id', 'text', 'created_at')
+    if row[2] then
+        out[#out + 1] = {row[1] or id, row[2], row[3]}
+    end
+end
+return out
+"""
+
+
+def _retention_cutoff(max_age_s: float) -> str:
+    # created_at is ISO text, so it compares correctly as a string; "" = no age limit
+    if max_age_s <= 0:
+        return ""
+    return (datetime.utcnow() - timedelta(seconds=max_age_s)).isoformat()
+
+
+def _redis_tokens(text: str) -> str:
+    # "tok:tf tok:tf", the form REDIS_INDEX_TOKENS_LUA reads
+    return " ".join(f"{t}:{n}" for t, n in Counter(search_tokens(text)).items())
+
+
+def _redis_search_rows(rows: List[List[Any]]) -> List[Dict[str, Any]]:
+    return [
+        {"id": int(msg_id), "text": text, "created_at": created_at or "", "score": round(float(score), 4)}
+        for msg_id, text, created_at, score in rows
+    ]
+
+
+def _redis_batch_args(texts: List[str]) -> List[str]:
+    # text, tokens, text, tokens... for REDIS_ADD_MESSAGES_LUA
+    args: List[str] = []
+    for text in texts:
+        args += [text, _redis_tokens(text)]
+    return args
+
+
+def _redis_page_args(limit: int, before_id: Optional[int], after_id: Optional[int]) -> List[Any]:
+    return [
+        max(1, limit),
+        "" if before_id is None else before_id,
+        "" if after_id is None else after_id,
+    ]
+
+
+def _redis_message_rows(rows: List[List[Any]]) -> List[Dict[str, Any]]:
+    # shape rows returned by REDIS_LIST_MESSAGES_LUA
+    items: List[Dict[str, Any]] = []
+    for msg_id, text, created_at in rows:
+        items.append(
+            {
+                "id": int(msg_id),
+                "text": text or "",
+                "created_at": created_at or "",
+            }
+        )
+    return items
 
 
 class RedisStore(Store):
@@ -143,56 +905,734 @@ class RedisStore(Store):
             raise RuntimeError("redis package not installed")
         # decode_responses=True to work with strings
         self.client = redis.Redis.from_url(url, decode_responses=True)
+        # server-side scripts: one round trip per call, atomic writes
+        self._add_message = self.client.register_script(REDIS_ADD_MESSAGE_LUA)
+        self._add_messages = self.client.register_script(REDIS_ADD_MESSAGES_LUA)
+        self._list_messages = self.client.register_script(REDIS_LIST_MESSAGES_LUA)
+        self._trim_messages = self.client.register_script(REDIS_TRIM_MESSAGES_LUA)
+        self._backfill_search = self.client.register_script(REDIS_BACKFILL_SEARCH_LUA)
+        self._search_messages = self.client.register_script(REDIS_SEARCH_MESSAGES_LUA)
+        self.search_backfill_pending = 0
+        self.shard_counts: Dict[str, int] = {}
+        self.shard_counts_at = float("-inf")
 
     def init(self) -> None:
+        if STORE_SCHEMA_READY:
+            return
         # nothing to initialize schema-wise
         # ensure 'visits' counter exists
         self.client.setnx("counters:visits", 0)
+        # messages up to the current seq predate the search index
+        self.client.setnx("search:backfill:until", self.client.get("messages:seq") or 0)
 
     def ping(self) -> None:
         self.client.ping()
 
+    def _counter_keys(self, name: str) -> List[str]:
+        if time.monotonic() - self.shard_counts_at > REDIS_SHARD_COUNTS_REFRESH_S:
+            self.shard_counts_at = time.monotonic()
+            self.shard_counts, missing = _merge_shard_counts(self.client.hgetall(REDIS_SHARD_COUNTS_KEY))
+            if missing:
+                self.client.hset(REDIS_SHARD_COUNTS_KEY, mapping=missing)
+        shards = max(self.shard_counts.get(name, 1), COUNTER_SHARDS.get(name, 1))
+        return _redis_counter_keys(name, shards)
+
     def get_counter(self, name: str) -> int:
-        v = self.client.get(f"counters:{name}")
-        return int(v) if v is not None else 0
+        return sum(int(v or 0) for v in self.client.mget(self._counter_keys(name)))
 
     def incr_counter(self, name: str, delta: int = 1) -> int:
-        return int(self.client.incrby(f"counters:{name}", delta))
+        return self.incr_counters({name: delta})[name]
+
+    def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        # plain commands on plain keys, so a cluster client can route each shard
+        keys = {name: self._counter_keys(name) for name in deltas}
+        pipe = self.client.pipeline(transaction=False)
+        for name, delta in deltas.items():
+            pipe.incrby(f"counters:{counter_shard_key(name)}", delta)
+        for name in deltas:
+            pipe.mget(keys[name])
+        values = pipe.execute()[len(deltas):]
+        return {name: sum(int(v or 0) for v in row) for name, row in zip(deltas, values)}
 
     def add_message(self, text: str) -> None:
-        msg_id = int(self.client.incr("messages:seq"))
-        key = f"message:{msg_id}"
-        self.client.hset(
-            key,
-            mapping={
-                "id": msg_id,
-                "text": text,
-                "created_at": datetime.utcnow().isoformat(),
-            },
+        self._add_message(
+            keys=["messages:seq", "messages:ids"],
+            args=[text, datetime.utcnow().isoformat(), REDIS_MESSAGES_CHANNEL, _redis_tokens(text)],
         )
-        # newest first for quick pagination
-        self.client.lpush("messages:ids", msg_id)
 
-    def list_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
-        ids = self.client.lrange("messages:ids", 0, max(0, limit - 1))
-        items: List[Dict[str, Any]] = []
-        for s in ids:
-            msg_id = int(s)
-            data = self.client.hgetall(f"message:{msg_id}")
-            if data:
-                # ensure correct types/shape
-                items.append(
-                    {
-                        "id": int(data.get("id", msg_id)),
-                        "text": data.get("text", ""),
-                        "created_at": data.get("created_at", ""),
-                    }
+    def add_messages(self, texts: List[str]) -> List[int]:
+        ids: List[int] = []
+        created_at = datetime.utcnow().isoformat()
+        for i in range(0, len(texts), REDIS_BATCH_CHUNK):
+            chunk = texts[i:i + REDIS_BATCH_CHUNK]
+            first = int(self._add_messages(
+                keys=["messages:seq", "messages:ids"],
+                args=[created_at, REDIS_MESSAGES_CHANNEL, *_redis_batch_args(chunk)],
+            ))
+            ids.extend(range(first, first + len(chunk)))
+        return ids
+
+    def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        rows = self._list_messages(keys=["messages:ids"], args=_redis_page_args(limit, before_id, after_id))
+        return _redis_message_rows(rows)
+
+    def messages_version(self) -> Optional[str]:
+        # last id handed out + oldest id kept (moves on compaction)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get("messages:seq")
+        pipe.lindex("messages:ids", -1)
+        seq, oldest = pipe.execute()
+        return f"{seq or 0}-{oldest or 0}"
+
+    def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        return int(self._trim_messages(
+            keys=["messages:ids"], args=[max_count, _retention_cutoff(max_age_s), max(1, batch)]
+        ))
+
+    def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        tokens = _query_tokens(query)
+        if not tokens:
+            return []
+        rows = self._search_messages(
+            keys=["messages:seq", REDIS_SEARCH_SCRATCH_KEY], args=[max(0, offset), max(1, limit), *tokens]
+        )
+        return _redis_search_rows(rows)
+
+    def backfill_search(self, batch: int) -> int:
+        done, until = (int(v or 0) for v in self.client.mget("search:backfill:done", "search:backfill:until"))
+        if done >= until:
+            self.search_backfill_pending = 0
+            return 0
+        upto = min(until, done + max(1, batch))
+        ids = list(range(done + 1, upto + 1))
+        pipe = self.client.pipeline(transaction=False)
+        for msg_id in ids:
+            pipe.hget(f"message:{msg_id}", "text")
+        texts = pipe.execute()
+        args: List[Any] = [upto]
+        for msg_id, text in zip(ids, texts):
+            if text is not None:
+                args += [msg_id, _redis_tokens(text)]
+        self._backfill_search(keys=["search:backfill:done"], args=args)
+        self.search_backfill_pending = until - upto
+        return upto - done
+
+    def stats(self) -> Dict[str, Any]:
+        return {"search_backfill_pending": self.search_backfill_pending}
+
+
+class AsyncRedisStore(AsyncStore):
+    """RedisStore on redis.asyncio; same keys and scripts, no worker thread per call."""
+
+    name = "redis"
+
+    def __init__(self, url: str) -> None:
+        if aioredis is None:
+            raise RuntimeError("redis package not installed")
+        self.client = aioredis.Redis.from_url(url, decode_responses=True)
+        self._add_message = self.client.register_script(REDIS_ADD_MESSAGE_LUA)
+        self._add_messages = self.client.register_script(REDIS_ADD_MESSAGES_LUA)
+        self._list_messages = self.client.register_script(REDIS_LIST_MESSAGES_LUA)
+        self._trim_messages = self.client.register_script(REDIS_TRIM_MESSAGES_LUA)
+        self._backfill_search = self.client.register_script(REDIS_BACKFILL_SEARCH_LUA)
+        self._search_messages = self.client.register_script(REDIS_SEARCH_MESSAGES_LUA)
+        self.search_backfill_pending = 0
+        self.shard_counts: Dict[str, int] = {}
+        self.shard_counts_at = float("-inf")
+
+    async def init(self) -> None:
+        if STORE_SCHEMA_READY:
+            return
+        await self.client.setnx("counters:visits", 0)
+        await self.client.setnx("search:backfill:until", await self.client.get("messages:seq") or 0)
+
+    async def ping(self) -> None:
+        await self.client.ping()
+
+    async def _counter_keys(self, name: str) -> List[str]:
+        if time.monotonic() - self.shard_counts_at > REDIS_SHARD_COUNTS_REFRESH_S:
+            self.shard_counts_at = time.monotonic()
+            recorded = await self.client.hgetall(REDIS_SHARD_COUNTS_KEY)
+            self.shard_counts, missing = _merge_shard_counts(recorded)
+            if missing:
+                await self.client.hset(REDIS_SHARD_COUNTS_KEY, mapping=missing)
+        shards = max(self.shard_counts.get(name, 1), COUNTER_SHARDS.get(name, 1))
+        return _redis_counter_keys(name, shards)
+
+    async def get_counter(self, name: str) -> int:
+        return sum(int(v or 0) for v in await self.client.mget(await self._counter_keys(name)))
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        return (await self.incr_counters({name: delta}))[name]
+
+    async def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        keys = {name: await self._counter_keys(name) for name in deltas}
+        async with self.client.pipeline(transaction=False) as pipe:
+            for name, delta in deltas.items():
+                pipe.incrby(f"counters:{counter_shard_key(name)}", delta)
+            for name in deltas:
+                pipe.mget(keys[name])
+            values = (await pipe.execute())[len(deltas):]
+        return {name: sum(int(v or 0) for v in row) for name, row in zip(deltas, values)}
+
+    async def add_message(self, text: str) -> None:
+        await self._add_message(
+            keys=["messages:seq", "messages:ids"],
+            args=[text, datetime.utcnow().isoformat(), REDIS_MESSAGES_CHANNEL, _redis_tokens(text)],
+        )
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        ids: List[int] = []
+        created_at = datetime.utcnow().isoformat()
+        for i in range(0, len(texts), REDIS_BATCH_CHUNK):
+            chunk = texts[i:i + REDIS_BATCH_CHUNK]
+            first = int(await self._add_messages(
+                keys=["messages:seq", "messages:ids"],
+                args=[created_at, REDIS_MESSAGES_CHANNEL, *_redis_batch_args(chunk)],
+            ))
+            ids.extend(range(first, first + len(chunk)))
+        return ids
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        rows = await self._list_messages(
+            keys=["messages:ids"], args=_redis_page_args(limit, before_id, after_id)
+        )
+        return _redis_message_rows(rows)
+
+    async def messages_version(self) -> Optional[str]:
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get("messages:seq")
+        pipe.lindex("messages:ids", -1)
+        seq, oldest = await pipe.execute()
+        return f"{seq or 0}-{oldest or 0}"
+
+    async def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        return int(await self._trim_messages(
+            keys=["messages:ids"], args=[max_count, _retention_cutoff(max_age_s), max(1, batch)]
+        ))
+
+    async def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        tokens = _query_tokens(query)
+        if not tokens:
+            return []
+        rows = await self._search_messages(
+            keys=["messages:seq", REDIS_SEARCH_SCRATCH_KEY], args=[max(0, offset), max(1, limit), *tokens]
+        )
+        return _redis_search_rows(rows)
+
+    async def backfill_search(self, batch: int) -> int:
+        values = await self.client.mget("search:backfill:done", "search:backfill:until")
+        done, until = (int(v or 0) for v in values)
+        if done >= until:
+            self.search_backfill_pending = 0
+            return 0
+        upto = min(until, done + max(1, batch))
+        ids = list(range(done + 1, upto + 1))
+        async with self.client.pipeline(transaction=False) as pipe:
+            for msg_id in ids:
+                pipe.hget(f"message:{msg_id}", "text")
+            texts = await pipe.execute()
+        args: List[Any] = [upto]
+        for msg_id, text in zip(ids, texts):
+            if text is not None:
+                args += [msg_id, _redis_tokens(text)]
+        await self._backfill_search(keys=["search:backfill:done"], args=args)
+        self.search_backfill_pending = until - upto
+        return upto - done
+
+    def stats(self) -> Dict[str, Any]:
+        return {"search_backfill_pending": self.search_backfill_pending}
+
+    def message_events(self) -> Optional[AsyncIterator[int]]:
+        return self._message_events()
+
+    async def _message_events(self) -> AsyncIterator[int]:
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(REDIS_MESSAGES_CHANNEL)
+        try:
+            async for msg in pubsub.listen():
+                if msg.get("type") == "message":
+                    yield int(msg["data"])
+        finally:
+            await pubsub.aclose()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class UpstreamUnavailable(RuntimeError):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Per-upstream breaker: `threshold` consecutive failures open it, after
+    `reset_s` a single half-open probe is let through, and the probe's outcome
+    closes it again or restarts the open period. threshold=0 disables it.
+    """
+
+    def __init__(self, name: str, threshold: int, reset_s: float) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.reset_s = reset_s
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_s:
+                self.state = "half_open"  # this caller is the probe
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def release(self) -> None:
+        # the call ended without an answer (cancelled): no verdict either way.
+        # A half-open probe gives its slot back, and since opened_at is left
+        # as it was the next caller probes right away; the failure count of a
+        # closed breaker is left alone
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+    def failure(self) -> None:
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of `fn`."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, _Flight] = {}
+        self.shared = 0
+
+    def do(self, key: Any, fn: Any) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines. The shared call runs as its own task, so a
+    cancelled caller (client went away) does not cancel it for the others."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[Any, "asyncio.Task[Any]"] = {}
+        self.shared = 0
+
+    async def do(self, key: Any, fn: Any) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Any, task: "asyncio.Task[Any]") -> None:
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved, even if every caller was cancelled
+
+
+class _MemoryMessage:
+    __slots__ = ("id", "text", "created_at")
+
+    def __init__(self, msg_id: int, text: str, created_at: str) -> None:
+        self.id = msg_id
+        self.text = text
+        self.created_at = created_at
+
+
+class MemoryStore(Store):
+    """Process-local store for single-pod runs, tests and as the benchmark baseline.
+
+    Counters are slots in an array('q') indexed through a name -> slot dict.
+    Messages live in a fixed ring buffer: message `id` sits in slot
+    (id - 1) % capacity, so a page is read newest first by walking ids down
+    from the cursor, O(limit), and the oldest messages are overwritten once
+    the ring is full. Writers reserve ids under one short lock and store
+    records under one of `stripes` slot locks; readers take no lock and skip
+    slots whose record id does not match (not written yet, or overwritten).
+    Search uses a token -> {id: term frequency} index kept next to the ring.
+
+    With `snapshot_path` the state is written to a JSON file every
+    `snapshot_s` seconds from a background thread and on close(), and loaded
+    again by init().
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        capacity: int = 100_000,
+        stripes: int = 16,
+        snapshot_path: str = "",
+        snapshot_s: float = 30.0,
+    ) -> None:
+        self.capacity = max(1, capacity)
+        self._ring: List[Optional[_MemoryMessage]] = [None] * self.capacity
+        self._stripes = [threading.Lock() for _ in range(max(1, stripes))]
+        self._seq = 0  # last id handed out
+        self._seq_lock = threading.Lock()
+        self._floor = 0  # ids up to here were removed by compaction
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._index_lock = threading.Lock()
+        self._slots: Dict[str, int] = {}
+        self._values = array.array("q")
+        self._counters_lock = threading.Lock()
+        self.snapshot_path = snapshot_path
+        self.snapshot_s = snapshot_s
+        self.snapshots = 0
+        self.last_snapshot: Optional[str] = None
+        self._stop = threading.Event()
+        self._snapshot_thread: Optional[threading.Thread] = None
+
+    def init(self) -> None:
+        if self.snapshot_path:
+            self._load_snapshot()
+            if self._snapshot_thread is None:
+                self._snapshot_thread = threading.Thread(
+                    target=self._snapshot_loop, name="memory-snapshot", daemon=True
                 )
+                self._snapshot_thread.start()
+        with self._counters_lock:
+            self._slot("visits")
+
+    def ping(self) -> None:
+        pass
+
+    def _slot(self, name: str) -> int:
+        # caller holds _counters_lock
+        slot = self._slots.get(name)
+        if slot is None:
+            slot = self._slots[name] = len(self._values)
+            self._values.append(0)
+        return slot
+
+    def get_counter(self, name: str) -> int:
+        slot = self._slots.get(name)
+        return 0 if slot is None else self._values[slot]
+
+    def incr_counter(self, name: str, delta: int = 1) -> int:
+        with self._counters_lock:
+            slot = self._slot(name)
+            self._values[slot] += delta
+            return self._values[slot]
+
+    def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        with self._counters_lock:
+            for name, delta in deltas.items():
+                slot = self._slot(name)
+                self._values[slot] += delta
+                out[name] = self._values[slot]
+        return out
+
+    def _reserve(self, n: int) -> int:
+        # first id of a block of n consecutive ids
+        with self._seq_lock:
+            first = self._seq + 1
+            self._seq += n
+        return first
+
+    def _put(self, record: _MemoryMessage) -> None:
+        slot = (record.id - 1) % self.capacity
+        with self._stripes[slot % len(self._stripes)]:
+            current = self._ring[slot]
+            # a slow writer must not clobber a newer message that wrapped around
+            if current is None or current.id < record.id:
+                self._ring[slot] = record
+                self._reindex(record, current)
+
+    def _reindex(self, added: Optional[_MemoryMessage], removed: Optional[_MemoryMessage]) -> None:
+        # caller holds the slot's stripe lock, so a record is unindexed exactly once
+        with self._index_lock:
+            if removed is not None:
+                for token in set(search_tokens(removed.text)):
+                    ids = self._postings.get(token)
+                    if ids is not None:
+                        ids.pop(removed.id, None)
+                        if not ids:
+                            del self._postings[token]
+            if added is not None:
+                for token, tf in Counter(search_tokens(added.text)).items():
+                    self._postings.setdefault(token, {})[added.id] = tf
+
+    def add_message(self, text: str) -> None:
+        self._put(_MemoryMessage(self._reserve(1), text, datetime.utcnow().isoformat()))
+
+    def add_messages(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        first = self._reserve(len(texts))
+        created_at = datetime.utcnow().isoformat()
+        for offset, text in enumerate(texts):
+            self._put(_MemoryMessage(first + offset, text, created_at))
+        return list(range(first, first + len(texts)))
+
+    def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        limit = max(1, limit)
+        seq = self._seq
+        oldest = max(1, seq - self.capacity + 1, self._floor + 1)
+        if after_id is not None:
+            bottom = max(oldest, after_id + 1)
+            top = min(seq, bottom + limit - 1)
+        else:
+            top = seq if before_id is None else min(seq, before_id - 1)
+            bottom = max(oldest, top - limit + 1)
+        items: List[Dict[str, Any]] = []
+        ring, capacity = self._ring, self.capacity
+        for msg_id in range(top, bottom - 1, -1):
+            record = ring[(msg_id - 1) % capacity]
+            if record is not None and record.id == msg_id:
+                items.append({"id": record.id, "text": record.text, "created_at": record.created_at})
         return items
 
+    def messages_version(self) -> Optional[str]:
+        # ring slots are only overwritten by new ids, so seq + floor say it all
+        return f"{self._seq}-{self._floor}"
+
+    def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        tokens = _query_tokens(query)
+        if not tokens:
+            return []
+        with self._index_lock:
+            postings = [self._postings.get(t) for t in tokens]
+            if not all(postings):
+                return []
+            # tf * idf summed over the query tokens, walking the rarest token's ids
+            total = max(1, self._seq - self._floor)
+            weighted = sorted(((p, math.log(1 + total / len(p))) for p in postings), key=lambda pw: len(pw[0]))
+            (first, first_w), rest = weighted[0], weighted[1:]
+            scores: Dict[int, float] = {}
+            for msg_id, tf in first.items():
+                score = tf * first_w
+                for ids, w in rest:
+                    other = ids.get(msg_id)
+                    if other is None:
+                        break
+                    score += other * w
+                else:
+                    scores[msg_id] = score
+        best = heapq.nlargest(max(0, offset) + max(1, limit), scores.items(), key=lambda kv: (kv[1], kv[0]))
+        items: List[Dict[str, Any]] = []
+        for msg_id, score in best[max(0, offset):]:
+            record = self._ring[(msg_id - 1) % self.capacity]
+            if record is not None and record.id == msg_id:
+                items.append({
+                    "id": record.id, "text": record.text, "created_at": record.created_at, "score": round(score, 4)
+                })
+        return items
+
+    def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        # the ring already bounds the count; this clears the oldest slots early
+        seq = self._seq
+        floor = seq - max_count if max_count > 0 else 0
+        cutoff = _retention_cutoff(max_age_s)
+        start = max(1, seq - self.capacity + 1, self._floor + 1)
+        deleted = 0
+        for msg_id in range(start, min(seq, start + batch - 1) + 1):
+            slot = (msg_id - 1) % self.capacity
+            with self._stripes[slot % len(self._stripes)]:
+                record = self._ring[slot]
+                if record is not None and record.id == msg_id:
+                    if msg_id > floor and not (cutoff and record.created_at < cutoff):
+                        break
+                    self._ring[slot] = None
+                    self._reindex(None, record)
+                    deleted += 1
+            self._floor = msg_id
+        return deleted
+
+    def close(self) -> None:
+        if self._snapshot_thread is not None:
+            self._stop.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+            self.snapshot()
+
+    def _snapshot_loop(self) -> None:
+        while not self._stop.wait(self.snapshot_s):
+            try:
+                self.snapshot()
+            except OSError:
+                pass  # keep serving from memory; the next round retries
+
+    def snapshot(self) -> None:
+        with self._counters_lock:
+            counters = {name: self._values[slot] for name, slot in self._slots.items()}
+        seq = self._seq
+        records = sorted((r for r in list(self._ring) if r is not None), key=lambda r: r.id)
+        data = {
+            "seq": seq,
+            "counters": counters,
+            "messages": [[r.id, r.text, r.created_at] for r in records],
+        }
+        path = pathlib.Path(self.snapshot_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False))
+        os.replace(tmp, path)  # readers never see a half-written snapshot
+        self.snapshots += 1
+        self.last_snapshot = datetime.utcnow().isoformat()
+
+    def _load_snapshot(self) -> None:
+        try:
+            data = json.loads(pathlib.Path(self.snapshot_path).read_text())
+        except FileNotFoundError:
+            return
+        with self._counters_lock:
+            for name, value in data.get("counters", {}).items():
+                self._values[self._slot(name)] = int(value)
+        for msg_id, text, created_at in data.get("messages", []):
+            self._put(_MemoryMessage(int(msg_id), text, created_at))
+        with self._seq_lock:
+            self._seq = max(self._seq, int(data.get("seq", 0)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": {
+                "messages": min(self._seq - self._floor, self.capacity),
+                "capacity": self.capacity,
+                "counters": len(self._slots),
+                "snapshots": self.snapshots,
+                "last_snapshot": self.last_snapshot,
+            }
+        }
+
+
+class RetryBudget:
+    """Token bucket shared by retries and hedges of one upstream: every read
+    earns `ratio` tokens (up to `burst`) and every extra attempt spends one, so
+    a failing upstream sees at most ~ratio extra load instead of a retry storm.
+    """
+
+    def __init__(self, ratio: float, burst: int) -> None:
+        self.ratio = ratio
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class LatencyWindow:
+    """Recent read latencies of one upstream; its p95 is the hedge delay."""
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, size: int = 256) -> None:
+        self.samples: "deque[float]" = deque(maxlen=size)
+        self._p95: Optional[float] = None
+        self._added = 0
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self._added += 1
+        if self._added % 16 == 0 or self._p95 is None:
+            # re-sort every few samples only; hedging does not need an exact p95
+            if len(self.samples) >= self.MIN_SAMPLES:
+                ordered = sorted(self.samples)
+                self._p95 = ordered[int(len(ordered) * 0.95) - 1]
+
+    def hedge_delay(self) -> Optional[float]:
+        # None until there is enough history to tell slow from normal
+        if self._p95 is None:
+            return None
+        return max(HTTP_HEDGE_MIN_MS / 1000.0, self._p95)
+
+
+def _retrieve(task: "asyncio.Future[Any]") -> None:
+    # mark a task's exception as seen when nobody awaits it any more
+    if not task.cancelled():
+        task.exception()
+
+
+class HttpUpstreams:
+    """Upstream URLs, headers, timeouts and pool limits shared by HttpStore and AsyncHttpStore.
+
+    Every call goes through the upstream's CircuitBreaker. Reads are keyed and
+    remembered, so while a breaker is open they are answered from the last good
+    value (if any) instead of failing. Below the breaker, reads are retried with
+    jittered backoff and optionally hedged, both paid from a RetryBudget.
+    """
 
-class HttpStore(Store):
     name = "http"
+    LAST_GOOD_SIZE = 1024
 
     def __init__(self, messages_api: Optional[str], counter_api: Optional[str]):
         if httpx is None:
@@ -200,6 +1640,33 @@ class HttpStore(Store):
         self.messages_api = messages_api  # like http://messages.course-app.svc.cluster.local/api
         self.counter_api = counter_api    # like http://counter.course-app.svc.cluster.local/api
         self.base_headers = {"X-App-Pod": HOSTNAME}
+        self.ping_timeout = httpx.Timeout(HTTP_PING_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self.read_timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self.write_timeout = httpx.Timeout(HTTP_WRITE_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self.breakers = {
+            upstream: CircuitBreaker(upstream, HTTP_BREAKER_FAILURES, HTTP_BREAKER_RESET_S)
+            for upstream in ("messages", "counter")
+        }
+        self.last_good: "OrderedDict[Any, Any]" = OrderedDict()
+        self.stale_served = 0
+        # key -> (upstream ETag, value) for conditional re-reads of message pages
+        self.validators: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.not_modified = 0
+        self.budgets = {up: RetryBudget(HTTP_RETRY_BUDGET, HTTP_RETRY_BURST) for up in self.breakers}
+        self.latency = {up: LatencyWindow() for up in self.breakers}
+        self.read_events: Dict[str, Dict[str, int]] = {up: {} for up in self.breakers}
+
+    def _client(self, cls: Any) -> Any:
+        # one long-lived keep-alive pool per upstream service
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        try:
+            return cls(limits=limits, timeout=self.read_timeout, headers=self.base_headers, http2=HTTP2)
+        except ImportError:
+            raise RuntimeError("h2 package not installed (required by APP_HTTP2)")
 
     def _headers(self) -> Dict[str, str]:
         h = dict(self.base_headers)
@@ -208,99 +1675,1599 @@ class HttpStore(Store):
             h["X-Request-ID"] = rid
         return h
 
+    @staticmethod
+    def _page_params(limit: int, before_id: Optional[int], after_id: Optional[int]) -> Dict[str, int]:
+        params = {"limit": limit}
+        if before_id is not None:
+            params["before_id"] = before_id
+        if after_id is not None:
+            params["after_id"] = after_id
+        return params
+
+    @staticmethod
+    def _items(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # ensure shape
+        out: List[Dict[str, Any]] = []
+        for it in data.get("items", []):
+            item = {
+                "id": int(it.get("id", 0)),
+                "text": str(it.get("text", "")),
+                "created_at": str(it.get("created_at", "")),
+            }
+            if "score" in it:
+                item["score"] = float(it["score"])
+            out.append(item)
+        return out
+
+    @staticmethod
+    def _is_outage(exc: BaseException) -> bool:
+        # timeouts, refused connections and 5xx count against the breaker; a 4xx
+        # means the upstream is up and answering
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code >= 500
+        return isinstance(exc, httpx.TransportError)
+
+    def _settle(self, upstream: str, exc: Optional[BaseException]) -> None:
+        breaker = self.breakers[upstream]
+        if exc is not None and self._is_outage(exc):
+            breaker.failure()
+        else:
+            breaker.success()
+
+    def _remember(self, key: Any, value: Any) -> None:
+        if key is None:
+            return
+        self.last_good[key] = value
+        self.last_good.move_to_end(key)
+        if len(self.last_good) > self.LAST_GOOD_SIZE:
+            self.last_good.popitem(last=False)
+
+    def _conditional_headers(self, cached: Optional[tuple]) -> Dict[str, str]:
+        h = self._headers()
+        if cached is not None:
+            h["If-None-Match"] = cached[0]
+        return h
+
+    def _revalidated(self, key: Any, cached: Optional[tuple], r: Any) -> List[Dict[str, Any]]:
+        # 304: the upstream's page is unchanged, skip the body and the parsing
+        if r.status_code == 304 and cached is not None:
+            self.not_modified += 1
+            return cached[1]
+        r.raise_for_status()
+        items = self._items(r.json())
+        etag = r.headers.get("etag")
+        if etag:
+            self.validators[key] = (etag, items)
+            self.validators.move_to_end(key)
+            if len(self.validators) > self.LAST_GOOD_SIZE:
+                self.validators.popitem(last=False)
+        return items
+
+    def _rejected(self, upstream: str, key: Any) -> Any:
+        # breaker is open: serve the last good value or fail fast
+        if key is not None and key in self.last_good:
+            self.stale_served += 1
+            return self.last_good[key]
+        raise UpstreamUnavailable(f"{upstream} upstream unavailable (circuit open)")
+
+    def _event(self, upstream: str, event: str) -> None:
+        # read, retry, retry_skipped, hedge, hedge_skipped, hedge_won
+        events = self.read_events[upstream]
+        events[event] = events.get(event, 0) + 1
+        if METRICS_ENABLED:
+            UPSTREAM_READ_EVENTS.labels(upstream, event).inc()
+
+    @staticmethod
+    def _retryable(exc: BaseException) -> bool:
+        # only failures that cost little time: a refused or timed-out connect and a
+        # 5xx answer. A read timeout already spent the whole timeout; retrying it
+        # would stack another one on the caller with no overall deadline
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code >= 500
+        return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+
+    def _retry_allowed(self, upstream: str, attempt: int, exc: BaseException) -> bool:
+        if attempt >= HTTP_READ_RETRIES or not self._retryable(exc):
+            return False
+        if not self.budgets[upstream].withdraw():
+            self._event(upstream, "retry_skipped")
+            return False
+        self._event(upstream, "retry")
+        return True
+
+    def _hedge_allowed(self, upstream: str) -> bool:
+        if not self.budgets[upstream].withdraw():
+            self._event(upstream, "hedge_skipped")
+            return False
+        self._event(upstream, "hedge")
+        return True
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # "full jitter": uniform in [0, base * 2^attempt], capped at 1 s
+        return random.uniform(0, min(1.0, HTTP_RETRY_BACKOFF_MS * (2 ** attempt) / 1000.0))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breakers": {name: b.to_dict() for name, b in self.breakers.items()},
+            "stale_served": self.stale_served,
+            "not_modified": self.not_modified,
+            "coalesced": self.flight.shared,
+            "reads": self.read_events,
+            "retry_tokens": {up: round(b.tokens, 2) for up, b in self.budgets.items()},
+            "hedge_delay_ms": {
+                up: None if w.hedge_delay() is None else round(w.hedge_delay() * 1000, 1)
+                for up, w in self.latency.items()
+            },
+        }
+
+
+class HttpStore(HttpUpstreams, Store):
+    def __init__(self, messages_api: Optional[str], counter_api: Optional[str]):
+        super().__init__(messages_api, counter_api)
+        self.messages_client = self._client(httpx.Client) if messages_api else None
+        self.counter_client = self._client(httpx.Client) if counter_api else None
+        self.flight = SingleFlight()
+        # hedges need a second thread; the loser is left to finish in the background
+        self.hedge_pool = (
+            concurrent.futures.ThreadPoolExecutor(HTTP_MAX_CONNECTIONS, thread_name_prefix="hedge")
+            if HTTP_HEDGE else None
+        )
+
+    def _call(self, upstream: str, key: Any, fn: Any) -> Any:
+        if not self.breakers[upstream].allow():
+            return self._rejected(upstream, key)
+        try:
+            value = fn()
+        except Exception as e:
+            self._settle(upstream, e)
+            raise
+        self._settle(upstream, None)
+        self._remember(key, value)
+        return value
+
+    def _read(self, upstream: str, key: Any, fn: Any) -> Any:
+        def attempts() -> Any:
+            return self._attempts(upstream, fn)
+
+        if not HTTP_COALESCE:
+            return self._call(upstream, key, attempts)
+        return self.flight.do(key, lambda: self._call(upstream, key, attempts))
+
+    def _attempts(self, upstream: str, fn: Any) -> Any:
+        self._event(upstream, "read")
+        self.budgets[upstream].deposit()
+        attempt = 0
+        while True:
+            try:
+                return self._hedged(upstream, fn)
+            except Exception as e:
+                if not self._retry_allowed(upstream, attempt, e):
+                    raise
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _hedged(self, upstream: str, fn: Any) -> Any:
+        delay = self.latency[upstream].hedge_delay() if self.hedge_pool else None
+        start = time.perf_counter()
+        if delay is None:
+            value = fn()
+        else:
+            # each attempt runs in its own copy of the context (request id header)
+            futures = {self.hedge_pool.submit(contextvars.copy_context().run, fn): "primary"}
+            done, _ = concurrent.futures.wait(futures, timeout=delay)
+            if not done and self._hedge_allowed(upstream):
+                futures[self.hedge_pool.submit(contextvars.copy_context().run, fn)] = "hedge"
+            pending = set(futures)
+            error: Optional[BaseException] = None
+            winner = None
+            while winner is None and pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for f in done:
+                    if f.exception() is None:
+                        winner = f
+                        break
+                    error = f.exception()
+            if winner is None:
+                raise error
+            if futures[winner] == "hedge":
+                self._event(upstream, "hedge_won")
+            value = winner.result()
+        self.latency[upstream].add(time.perf_counter() - start)
+        return value
+
     def init(self) -> None:
         # nothing to init
         pass
 
     def ping(self) -> None:
         # any call to validate availability; prefer counter if set, else messages
-        url = None
-        if self.counter_api:
-            url = f"{self.counter_api}/counter/visits"
-        elif self.messages_api:
-            url = f"{self.messages_api}/messages?limit=1"
-        if url:
-            with httpx.Client(timeout=2.0, headers=self._headers()) as c:
-                r = c.get(url)
-                r.raise_for_status()
+        if self.counter_client:
+            r = self.counter_client.get(
+                f"{self.counter_api}/counter/visits", headers=self._headers(), timeout=self.ping_timeout
+            )
+            r.raise_for_status()
+        elif self.messages_client:
+            r = self.messages_client.get(
+                f"{self.messages_api}/messages",
+                params={"limit": 1},
+                headers=self._headers(),
+                timeout=self.ping_timeout,
+            )
+            r.raise_for_status()
 
     def get_counter(self, name: str) -> int:
-        if not self.counter_api:
+        if not self.counter_client:
             # best effort fallback: keep a local zero
             return 0
-        with httpx.Client(timeout=3.0, headers=self._headers()) as c:
-            r = c.get(f"{self.counter_api}/counter/{name}")
+
+        def fetch() -> int:
+            r = self.counter_client.get(
+                f"{self.counter_api}/counter/{name}", headers=self._headers(), timeout=self.read_timeout
+            )
             r.raise_for_status()
-            data = r.json()
-            return int(data.get("value", 0))
+            return int(r.json().get("value", 0))
+
+        return self._read("counter", ("counter", name), fetch)
 
     def incr_counter(self, name: str, delta: int = 1) -> int:
-        if not self.counter_api:
+        if not self.counter_client:
             return 0
-        with httpx.Client(timeout=3.0, headers=self._headers()) as c:
-            r = c.post(f"{self.counter_api}/counter/{name}/incr", params={"delta": delta})
+
+        def send() -> int:
+            r = self.counter_client.post(
+                f"{self.counter_api}/counter/{name}/incr",
+                params={"delta": delta},
+                headers=self._headers(),
+                timeout=self.write_timeout,
+            )
             r.raise_for_status()
-            data = r.json()
-            return int(data.get("value", 0))
+            return int(r.json().get("value", 0))
+
+        # never answered from last_good, but refreshes the value get_counter falls back to
+        value = self._call("counter", None, send)
+        self._remember(("counter", name), value)
+        return value
 
     def add_message(self, text: str) -> None:
-        if not self.messages_api:
+        if not self.messages_client:
+            return
+
+        def send() -> None:
+            r = self.messages_client.post(
+                f"{self.messages_api}/messages",
+                data={"text": text},
+                headers=self._headers(),
+                timeout=self.write_timeout,
+            )
+            r.raise_for_status()
+
+        self._call("messages", None, send)
+
+    def add_messages(self, texts: List[str]) -> List[int]:
+        if not self.messages_client or not texts:
+            return []
+
+        def send() -> List[int]:
+            r = self.messages_client.post(
+                f"{self.messages_api}/messages/batch",
+                json=texts,
+                headers=self._headers(),
+                timeout=self.write_timeout,
+            )
+            r.raise_for_status()
+            return [int(i) for i in r.json().get("ids", [])]
+
+        return self._call("messages", None, send)
+
+    def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        if not self.messages_client:
+            return []
+
+        key = ("messages", limit, before_id, after_id)
+
+        def fetch() -> List[Dict[str, Any]]:
+            cached = self.validators.get(key)
+            r = self.messages_client.get(
+                f"{self.messages_api}/messages",
+                params=self._page_params(limit, before_id, after_id),
+                headers=self._conditional_headers(cached),
+                timeout=self.read_timeout,
+            )
+            return self._revalidated(key, cached, r)
+
+        return self._read("messages", key, fetch)
+
+    def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        if not self.messages_client:
+            return []
+
+        def fetch() -> List[Dict[str, Any]]:
+            r = self.messages_client.get(
+                f"{self.messages_api}/messages/search",
+                params={"q": query, "limit": limit, "offset": offset},
+                headers=self._headers(),
+                timeout=self.read_timeout,
+            )
+            r.raise_for_status()
+            return self._items(r.json())
+
+        return self._read("messages", ("search", query, limit, offset), fetch)
+
+    def close(self) -> None:
+        if self.hedge_pool is not None:
+            self.hedge_pool.shutdown(wait=False)
+        for client in (self.messages_client, self.counter_client):
+            if client is not None:
+                client.close()
+
+
+class AsyncHttpStore(HttpUpstreams, AsyncStore):
+    def __init__(self, messages_api: Optional[str], counter_api: Optional[str]):
+        super().__init__(messages_api, counter_api)
+        self.messages_client = self._client(httpx.AsyncClient) if messages_api else None
+        self.counter_client = self._client(httpx.AsyncClient) if counter_api else None
+        self.flight = AsyncSingleFlight()
+
+    async def _call(self, upstream: str, key: Any, fn: Any) -> Any:
+        if not self.breakers[upstream].allow():
+            return self._rejected(upstream, key)
+        try:
+            value = await fn()
+        except asyncio.CancelledError:
+            self.breakers[upstream].release()
+            raise
+        except Exception as e:
+            self._settle(upstream, e)
+            raise
+        self._settle(upstream, None)
+        self._remember(key, value)
+        return value
+
+    async def _read(self, upstream: str, key: Any, fn: Any) -> Any:
+        def attempts() -> Any:
+            return self._attempts(upstream, fn)
+
+        if not HTTP_COALESCE:
+            return await self._call(upstream, key, attempts)
+        return await self.flight.do(key, lambda: self._call(upstream, key, attempts))
+
+    async def _attempts(self, upstream: str, fn: Any) -> Any:
+        self._event(upstream, "read")
+        self.budgets[upstream].deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(upstream, fn)
+            except Exception as e:
+                if not self._retry_allowed(upstream, attempt, e):
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def _hedged(self, upstream: str, fn: Any) -> Any:
+        delay = self.latency[upstream].hedge_delay() if HTTP_HEDGE else None
+        start = time.perf_counter()
+        if delay is None:
+            value = await fn()
+        else:
+            tasks = {asyncio.ensure_future(fn()): "primary"}
+            try:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._hedge_allowed(upstream):
+                    tasks[asyncio.ensure_future(fn())] = "hedge"
+                pending = set(tasks)
+                error: Optional[BaseException] = None
+                winner = None
+                while winner is None and pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for t in done:
+                        if t.exception() is None:
+                            winner = t
+                            break
+                        error = t.exception()
+                if winner is None:
+                    raise error
+                if tasks[winner] == "hedge":
+                    self._event(upstream, "hedge_won")
+                value = winner.result()
+            finally:
+                for t in tasks:
+                    t.add_done_callback(_retrieve)
+                    t.cancel()  # the loser; no-op for finished tasks
+        self.latency[upstream].add(time.perf_counter() - start)
+        return value
+
+    async def init(self) -> None:
+        pass
+
+    async def ping(self) -> None:
+        if self.counter_client:
+            r = await self.counter_client.get(
+                f"{self.counter_api}/counter/visits", headers=self._headers(), timeout=self.ping_timeout
+            )
+            r.raise_for_status()
+        elif self.messages_client:
+            r = await self.messages_client.get(
+                f"{self.messages_api}/messages",
+                params={"limit": 1},
+                headers=self._headers(),
+                timeout=self.ping_timeout,
+            )
+            r.raise_for_status()
+
+    async def get_counter(self, name: str) -> int:
+        if not self.counter_client:
+            return 0
+
+        async def fetch() -> int:
+            r = await self.counter_client.get(
+                f"{self.counter_api}/counter/{name}", headers=self._headers(), timeout=self.read_timeout
+            )
+            r.raise_for_status()
+            return int(r.json().get("value", 0))
+
+        return await self._read("counter", ("counter", name), fetch)
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        if not self.counter_client:
+            return 0
+
+        async def send() -> int:
+            r = await self.counter_client.post(
+                f"{self.counter_api}/counter/{name}/incr",
+                params={"delta": delta},
+                headers=self._headers(),
+                timeout=self.write_timeout,
+            )
+            r.raise_for_status()
+            return int(r.json().get("value", 0))
+
+        value = await self._call("counter", None, send)
+        self._remember(("counter", name), value)
+        return value
+
+    async def add_message(self, text: str) -> None:
+        if not self.messages_client:
             return
-        with httpx.Client(timeout=3.0, headers=self._headers()) as c:
-            r = c.post(f"{self.messages_api}/messages", data={"text": text})
+
+        async def send() -> None:
+            r = await self.messages_client.post(
+                f"{self.messages_api}/messages",
+                data={"text": text},
+                headers=self._headers(),
+                timeout=self.write_timeout,
+            )
             r.raise_for_status()
 
-    def list_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
-        if not self.messages_api:
+        await self._call("messages", None, send)
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        if not self.messages_client or not texts:
             return []
-        with httpx.Client(timeout=3.0, headers=self._headers()) as c:
-            r = c.get(f"{self.messages_api}/messages", params={"limit": limit})
+
+        async def send() -> List[int]:
+            r = await self.messages_client.post(
+                f"{self.messages_api}/messages/batch",
+                json=texts,
+                headers=self._headers(),
+                timeout=self.write_timeout,
+            )
             r.raise_for_status()
-            data = r.json()
-            items = data.get("items", [])
-            # ensure shape
-            out: List[Dict[str, Any]] = []
-            for it in items:
-                out.append({
-                    "id": int(it.get("id", 0)),
-                    "text": str(it.get("text", "")),
-                    "created_at": str(it.get("created_at", "")),
-                })
-            return out
+            return [int(i) for i in r.json().get("ids", [])]
+
+        return await self._call("messages", None, send)
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        if not self.messages_client:
+            return []
+
+        key = ("messages", limit, before_id, after_id)
+
+        async def fetch() -> List[Dict[str, Any]]:
+            cached = self.validators.get(key)
+            r = await self.messages_client.get(
+                f"{self.messages_api}/messages",
+                params=self._page_params(limit, before_id, after_id),
+                headers=self._conditional_headers(cached),
+                timeout=self.read_timeout,
+            )
+            return self._revalidated(key, cached, r)
+
+        return await self._read("messages", key, fetch)
+
+    async def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        if not self.messages_client:
+            return []
+
+        async def fetch() -> List[Dict[str, Any]]:
+            r = await self.messages_client.get(
+                f"{self.messages_api}/messages/search",
+                params={"q": query, "limit": limit, "offset": offset},
+                headers=self._headers(),
+                timeout=self.read_timeout,
+            )
+            r.raise_for_status()
+            return self._items(r.json())
+
+        return await self._read("messages", ("search", query, limit, offset), fetch)
+
+    def export_stream(self, fmt: str) -> Optional[AsyncIterator[bytes]]:
+        if not self.messages_client:
+            return None
+        if not self.breakers["messages"].allow():
+            raise UpstreamUnavailable("messages upstream unavailable (circuit open)")
+        return self._proxy_export(fmt)
+
+    async def _proxy_export(self, fmt: str) -> AsyncIterator[bytes]:
+        try:
+            async with self.messages_client.stream(
+                "GET",
+                f"{self.messages_api}/messages/export",
+                params={"format": fmt},
+                headers=self._headers(),
+                timeout=self.read_timeout,
+            ) as r:
+                r.raise_for_status()
+                self._settle("messages", None)
+                async for chunk in r.aiter_bytes():
+                    yield chunk
+        except Exception as e:
+            self._settle("messages", e)
+            raise
+
+    async def close(self) -> None:
+        for client in (self.messages_client, self.counter_client):
+            if client is not None:
+                await client.aclose()
+
+
+class ThreadedAsyncStore(AsyncStore):
+    """Runs a blocking Store in worker threads, capped by its own limiter.
+
+    Used for SqliteStore, and for every backend when APP_ASYNC_STORE=false. The
+    limiter queues store calls instead of letting them take over the threadpool
+    that Starlette shares with the rest of the app.
+    """
+
+    def __init__(self, inner: Store, threads: int = STORE_THREADS) -> None:
+        self.inner = inner
+        self.name = inner.name
+        self.limiter = anyio.CapacityLimiter(max(1, threads))
+
+    async def _run(self, fn: Any, *args: Any) -> Any:
+        return await anyio.to_thread.run_sync(fn, *args, limiter=self.limiter)
+
+    async def init(self) -> None:
+        await self._run(self.inner.init)
+
+    async def ping(self) -> None:
+        await self._run(self.inner.ping)
+
+    async def get_counter(self, name: str) -> int:
+        return await self._run(self.inner.get_counter, name)
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        return await self._run(self.inner.incr_counter, name, delta)
+
+    async def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        return await self._run(self.inner.incr_counters, deltas)
+
+    async def add_message(self, text: str) -> None:
+        await self._run(self.inner.add_message, text)
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        return await self._run(self.inner.add_messages, texts)
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return await self._run(self.inner.list_messages, limit, before_id, after_id)
+
+    async def messages_version(self) -> Optional[str]:
+        return await self._run(self.inner.messages_version)
+
+    async def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        return await self._run(self.inner.compact_messages, max_count, max_age_s, batch)
+
+    async def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        return await self._run(self.inner.search_messages, query, limit, offset)
+
+    async def backfill_search(self, batch: int) -> int:
+        return await self._run(self.inner.backfill_search, batch)
+
+    async def close(self) -> None:
+        await self._run(self.inner.close)
+
+    def stats(self) -> Dict[str, Any]:
+        out = dict(self.inner.stats())
+        out["store_threads"] = {"busy": self.limiter.borrowed_tokens, "size": self.limiter.total_tokens}
+        return out
+
+
+class InlineAsyncStore(AsyncStore):
+    """Calls a Store whose methods never block (MemoryStore) on the event loop
+    itself; a thread hop would cost more than the call."""
+
+    def __init__(self, inner: Store) -> None:
+        self.inner = inner
+        self.name = inner.name
+
+    async def init(self) -> None:
+        self.inner.init()
+
+    async def ping(self) -> None:
+        self.inner.ping()
+
+    async def get_counter(self, name: str) -> int:
+        return self.inner.get_counter(name)
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        return self.inner.incr_counter(name, delta)
+
+    async def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        return self.inner.incr_counters(deltas)
+
+    async def add_message(self, text: str) -> None:
+        self.inner.add_message(text)
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        return self.inner.add_messages(texts)
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return self.inner.list_messages(limit, before_id, after_id)
+
+    async def messages_version(self) -> Optional[str]:
+        return self.inner.messages_version()
+
+    async def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        return self.inner.compact_messages(max_count, max_age_s, batch)
+
+    async def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        return self.inner.search_messages(query, limit, offset)
+
+    async def close(self) -> None:
+        # joins the snapshot thread and writes a final snapshot
+        await anyio.to_thread.run_sync(self.inner.close)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.inner.stats()
+
+
+class StoreWrapper(AsyncStore):
+    """Base for stores that decorate another store; forwards every call."""
 
+    def __init__(self, inner: AsyncStore) -> None:
+        self.inner = inner
+        self.name = inner.name
 
-def create_store() -> Store:
+    async def init(self) -> None:
+        await self.inner.init()
+
+    async def ping(self) -> None:
+        await self.inner.ping()
+
+    async def get_counter(self, name: str) -> int:
+        return await self.inner.get_counter(name)
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        return await self.inner.incr_counter(name, delta)
+
+    async def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        return await self.inner.incr_counters(deltas)
+
+    async def add_message(self, text: str) -> None:
+        await self.inner.add_message(text)
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        return await self.inner.add_messages(texts)
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return await self.inner.list_messages(limit=limit, before_id=before_id, after_id=after_id)
+
+    async def messages_version(self) -> Optional[str]:
+        return await self.inner.messages_version()
+
+    async def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        return await self.inner.compact_messages(max_count, max_age_s, batch)
+
+    async def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        return await self.inner.search_messages(query, limit, offset)
+
+    async def backfill_search(self, batch: int) -> int:
+        return await self.inner.backfill_search(batch)
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+    def export_messages(self, batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        return self.inner.export_messages(batch_size)
+
+    def export_stream(self, fmt: str) -> Optional[AsyncIterator[bytes]]:
+        return self.inner.export_stream(fmt)
+
+    def message_events(self) -> Optional[AsyncIterator[int]]:
+        return self.inner.message_events()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.inner.stats()
+
+
+class CoalescingCounterStore(StoreWrapper):
+    """Write-behind counters: increments are summed in memory per name and
+    flushed with one incr_counters() call every `flush_ms` or once `max_pending`
+    increments are buffered. Reads return persisted value + local pending delta.
+    """
+
+    def __init__(self, inner: AsyncStore, flush_ms: int, max_pending: int) -> None:
+        super().__init__(inner)
+        self.interval = flush_ms / 1000.0
+        self.max_pending = max(1, max_pending)
+        self._flush_lock = asyncio.Lock()
+        self._pending: Dict[str, int] = {}
+        self._inflight: Dict[str, int] = {}
+        self._base: Dict[str, int] = {}  # last persisted value seen per name
+        self._events = 0
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def init(self) -> None:
+        await super().init()
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # deltas were put back by flush(); retry on the next tick
+                pass
+
+    def _local(self, name: str) -> int:
+        return self._pending.get(name, 0) + self._inflight.get(name, 0)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            self._events = 0
+            try:
+                values = await self.inner.incr_counters(batch)
+            except Exception:
+                for name, delta in batch.items():
+                    self._pending[name] = self._pending.get(name, 0) + delta
+                raise
+            else:
+                self._base.update(values)
+            finally:
+                self._inflight = {}
+
+    async def get_counter(self, name: str) -> int:
+        value = await self.inner.get_counter(name)
+        self._base[name] = value
+        return value + self._local(name)
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        if name not in self._base:
+            # first sight of this counter: learn its persisted value once
+            await self.get_counter(name)
+        self._pending[name] = self._pending.get(name, 0) + delta
+        self._events += 1
+        if self._events >= self.max_pending:
+            self._wake.set()
+        return self._base.get(name, 0) + self._local(name)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            # let the loop finish on its own: cancelling it mid-flush would drop
+            # the batch that is on its way to the backend
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await super().close()
+
+
+class CachedMessagesStore(StoreWrapper):
+    """In-process TTL/LRU cache for list_messages pages.
+
+    Entries are dropped on local add_message(), whenever messages_version()
+    sees the backend's version move (a write from another worker or pod) and,
+    when the backend publishes message events (Redis), on those as well; the
+    TTL bounds staleness for callers that never ask for the version.
+    """
+
+    def __init__(self, inner: AsyncStore, ttl_ms: int, max_entries: int) -> None:
+        super().__init__(inner)
+        self.ttl = ttl_ms / 1000.0
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # bumped on every invalidation so a read that raced a write is not cached
+        self._generation = 0
+        # backend version the entries were filled at
+        self._version: Optional[str] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def init(self) -> None:
+        await super().init()
+        if self._task is None and self.inner.message_events() is not None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        while True:
+            events = self.inner.message_events()
+            if events is None:
+                return
+            try:
+                async for _ in events:
+                    self.invalidate()
+            except Exception:
+                pass
+            # events may have been missed while (re)subscribing
+            self.invalidate()
+            await asyncio.sleep(1.0)
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+        self._generation += 1
+        self.invalidations += 1
+
+    async def add_message(self, text: str) -> None:
+        await self.inner.add_message(text)
+        self.invalidate()
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        ids = await self.inner.add_messages(texts)
+        self.invalidate()
+        return ids
+
+    async def messages_version(self) -> Optional[str]:
+        version = await self.inner.messages_version()
+        # another process wrote without telling us: the entries belong to the old
+        # version, and serving one under the new ETag would make clients keep it
+        if version != self._version:
+            self._version = version
+            self.invalidate()
+        return version
+
+    async def compact_messages(self, max_count: int, max_age_s: float, batch: int) -> int:
+        deleted = await self.inner.compact_messages(max_count, max_age_s, batch)
+        if deleted:
+            self.invalidate()
+        return deleted
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        key = (limit, before_id, after_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        generation = self._generation
+        items = await self.inner.list_messages(limit=limit, before_id=before_id, after_id=after_id)
+        if generation == self._generation:
+            self._entries[key] = (time.monotonic() + self.ttl, items)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return items
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await super().close()
+
+    def stats(self) -> Dict[str, Any]:
+        out = dict(self.inner.stats())
+        out["messages_cache"] = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "cross_pod": self._task is not None,
+        }
+        return out
+
+
+if METRICS_ENABLED:
+    # store calls and requests range from sub-millisecond (sqlite) to seconds (slow upstream)
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    HTTP_LATENCY = prometheus_client.Histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency by route template and status (_count is the request count)",
+        ["method", "route", "status"],
+        buckets=LATENCY_BUCKETS,
+    )
+    HTTP_IN_FLIGHT = prometheus_client.Gauge("http_requests_in_flight", "HTTP requests being handled")
+    STORE_LATENCY = prometheus_client.Histogram(
+        "store_operation_duration_seconds",
+        "Store call latency as seen by the route handlers",
+        ["store", "operation", "outcome"],
+        buckets=LATENCY_BUCKETS,
+    )
+    STORE_IN_FLIGHT = prometheus_client.Gauge(
+        "store_operations_in_flight", "Store calls in progress", ["store", "operation"]
+    )
+    THREADPOOL_BUSY = prometheus_client.Gauge("threadpool_busy_threads", "Worker threads in use", ["pool"])
+    THREADPOOL_SIZE = prometheus_client.Gauge("threadpool_size", "Worker thread limit", ["pool"])
+    UPSTREAM_READ_EVENTS = prometheus_client.Counter(
+        "upstream_read_events",
+        "HTTP store reads and their retries/hedges; divide by event=read for rates",
+        ["upstream", "event"],
+    )
+
+
+class InstrumentedStore(StoreWrapper):
+    """Records latency histograms and in-flight gauges per store operation,
+    and adds each operation's time to the current request's Server-Timing.
+    """
+
+    @contextmanager
+    def _observe(self, operation: str) -> Iterator[None]:
+        if METRICS_ENABLED:
+            in_flight = STORE_IN_FLIGHT.labels(self.name, operation)
+            in_flight.inc()
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            elapsed = time.perf_counter() - start
+            timing = REQ_TIMING_CTX.get()
+            if timing is not None:
+                timing["store"] += elapsed
+            if METRICS_ENABLED:
+                in_flight.dec()
+                STORE_LATENCY.labels(self.name, operation, outcome).observe(elapsed)
+
+    async def ping(self) -> None:
+        with self._observe("ping"):
+            await self.inner.ping()
+
+    async def get_counter(self, name: str) -> int:
+        with self._observe("get_counter"):
+            return await self.inner.get_counter(name)
+
+    async def incr_counter(self, name: str, delta: int = 1) -> int:
+        with self._observe("incr_counter"):
+            return await self.inner.incr_counter(name, delta)
+
+    async def incr_counters(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        with self._observe("incr_counters"):
+            return await self.inner.incr_counters(deltas)
+
+    async def add_message(self, text: str) -> None:
+        with self._observe("add_message"):
+            await self.inner.add_message(text)
+
+    async def add_messages(self, texts: List[str]) -> List[int]:
+        with self._observe("add_messages"):
+            return await self.inner.add_messages(texts)
+
+    async def list_messages(
+        self, limit: int = 20, before_id: Optional[int] = None, after_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        with self._observe("list_messages"):
+            return await self.inner.list_messages(limit=limit, before_id=before_id, after_id=after_id)
+
+    async def messages_version(self) -> Optional[str]:
+        with self._observe("messages_version"):
+            return await self.inner.messages_version()
+
+    async def search_messages(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        with self._observe("search_messages"):
+            return await self.inner.search_messages(query, limit, offset)
+
+
+def create_sync_store() -> Store:
     # http microservices mode (messages + counter services)
     if STORE_BACKEND == "http" or (MESSAGES_API or COUNTER_API):
         return HttpStore(messages_api=MESSAGES_API or None, counter_api=COUNTER_API or None)
     if STORE_BACKEND == "redis":
         return RedisStore(REDIS_URL)
+    if STORE_BACKEND == "memory":
+        return MemoryStore(MEMORY_MAX_MESSAGES, snapshot_path=MEMORY_SNAPSHOT_PATH, snapshot_s=MEMORY_SNAPSHOT_S)
     # default to sqlite
     return SqliteStore(DB_PATH)
 
 
+def create_store() -> AsyncStore:
+    backend: AsyncStore
+    if not ASYNC_STORE:
+        # blocking clients in worker threads (the pre-async behaviour)
+        backend = ThreadedAsyncStore(create_sync_store())
+    elif STORE_BACKEND == "http" or (MESSAGES_API or COUNTER_API):
+        backend = AsyncHttpStore(messages_api=MESSAGES_API or None, counter_api=COUNTER_API or None)
+    elif STORE_BACKEND == "redis":
+        backend = AsyncRedisStore(REDIS_URL)
+    elif STORE_BACKEND == "memory":
+        backend = InlineAsyncStore(create_sync_store())
+    else:
+        # sqlite3 has no async API, offload to a bounded set of threads
+        backend = ThreadedAsyncStore(SqliteStore(DB_PATH))
+    if COUNTER_FLUSH_MS > 0:
+        backend = CoalescingCounterStore(backend, COUNTER_FLUSH_MS, COUNTER_FLUSH_MAX)
+    if MESSAGES_CACHE_TTL_MS > 0:
+        backend = CachedMessagesStore(backend, MESSAGES_CACHE_TTL_MS, MESSAGES_CACHE_SIZE)
+    if METRICS_ENABLED or SERVER_TIMING:
+        backend = InstrumentedStore(backend)
+    return backend
+
+
+class MessageCompactor:
+    """Background retention for the app's store.
+
+    Every `interval_s` it calls store.compact_messages() one `batch` at a
+    time until a call deletes less than a full batch. Each call is a short
+    store operation of its own, so request handlers interleave with the
+    compaction instead of queueing behind one big delete.
+    """
+
+    def __init__(self, max_count: int, max_age_s: float, interval_s: float, batch: int) -> None:
+        self.max_count = max_count
+        self.max_age_s = max_age_s
+        self.interval_s = interval_s
+        self.batch = max(1, batch)
+        self.enabled = max_count > 0 or max_age_s > 0
+        self.running = False
+        self.runs = 0
+        self.deleted = 0
+        self.last_run: Optional[str] = None
+        self.last_deleted = 0
+        self.last_duration_ms = 0.0
+        self.last_error: Optional[str] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                # keep going; a store hiccup should not end retention for good
+                self.last_error = str(e)
+            await asyncio.sleep(self.interval_s)
+
+    async def run_once(self) -> int:
+        self.running = True
+        self.last_run = datetime.utcnow().isoformat()
+        self.last_deleted = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                n = await store.compact_messages(self.max_count, self.max_age_s, self.batch)
+                self.last_deleted += n
+                self.deleted += n
+                if n < self.batch:
+                    break
+                await asyncio.sleep(0)
+        finally:
+            self.running = False
+            self.runs += 1
+            self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.last_error = None
+        return self.last_deleted
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_messages": self.max_count,
+            "max_age_s": self.max_age_s,
+            "running": self.running,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "last_run": self.last_run,
+            "last_deleted": self.last_deleted,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error,
+        }
+
+
+async def backfill_search_index() -> None:
+    # index messages written before the search index existed, one short store
+    # call per batch; requests keep being served in between
+    while True:
+        try:
+            while await store.backfill_search(SEARCH_BACKFILL_BATCH):
+                await asyncio.sleep(0)
+            return
+        except NotImplementedError:
+            return
+        except Exception:
+            # store not reachable yet; the index keeps working for new messages
+            await asyncio.sleep(5)
+
+
+class MessageBroadcaster:
+    """Fans new messages out to /api/messages/stream subscribers.
+
+    One pump task per process reads each new message page once and hands it
+    to every subscriber, so N open streams cost one store read, not N. The
+    pump is woken by local writes (notify()) and, when the store publishes
+    them, by message ids from other pods (Redis pub/sub); without such a
+    source it also polls every `poll_s`. Each subscriber has a bounded queue:
+    one that falls `queue_size` messages behind is dropped with a resync
+    marker (None) instead of holding memory or slowing the others down.
+    """
+
+    def __init__(self, queue_size: int, max_subscribers: int, poll_s: float) -> None:
+        self.queue_size = max(1, queue_size)
+        self.max_subscribers = max_subscribers
+        self.poll_s = poll_s
+        self.source = "local"
+        self.delivered = 0
+        self.resyncs = 0
+        self._subscribers: Set["asyncio.Queue[Optional[Dict[str, Any]]]"] = set()
+        self._wake = asyncio.Event()
+        self._last_id: Optional[int] = None
+        self._wanted = 0
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        # an Event belongs to the loop it is first awaited on; a restarted app
+        # (a second lifespan in the same process) runs on a new one
+        self._wake = asyncio.Event()
+        self._tasks.append(asyncio.create_task(self._pump()))
+        if store.message_events() is not None:
+            self.source = "pubsub"
+            self._tasks.append(asyncio.create_task(self._listen()))
+        elif self.poll_s > 0:
+            self.source = "poll"
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        for q in list(self._subscribers):
+            self._resync(q)
+
+    def notify(self, msg_id: Optional[int] = None) -> None:
+        if msg_id is not None and msg_id > self._wanted:
+            self._wanted = msg_id
+        self._wake.set()
+
+    async def subscribe(self) -> "asyncio.Queue[Optional[Dict[str, Any]]]":
+        if len(self._subscribers) >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="too many stream subscribers")
+        if self._last_id is None:
+            # baseline: only messages newer than this are pushed
+            newest = await store.list_messages(limit=1)
+            if self._last_id is None:
+                self._last_id = newest[0]["id"] if newest else 0
+        q: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(self.queue_size)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: "asyncio.Queue[Optional[Dict[str, Any]]]") -> None:
+        self._subscribers.discard(q)
+
+    def _resync(self, q: "asyncio.Queue[Optional[Dict[str, Any]]]") -> None:
+        self._subscribers.discard(q)
+        while not q.empty():
+            q.get_nowait()
+        q.put_nowait(None)
+        self.resyncs += 1
+
+    async def _listen(self) -> None:
+        while True:
+            events = store.message_events()
+            if events is None:
+                return
+            try:
+                async for msg_id in events:
+                    self.notify(msg_id)
+            except Exception:
+                pass
+            # messages may have been published while (re)subscribing
+            self.notify()
+            await asyncio.sleep(1.0)
+
+    async def _pump(self) -> None:
+        timeout = self.poll_s if self.source == "poll" else None
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._subscribers:
+                # nobody listening: the next subscriber takes a fresh baseline
+                self._last_id = None
+                continue
+            try:
+                await self._deliver_new()
+            except Exception:
+                # store hiccup; the next wake-up or poll reads the gap again
+                await asyncio.sleep(1.0)
+
+    async def _deliver_new(self) -> None:
+        for attempt in range(20):
+            last_id = self._last_id or 0
+            page = await store.list_messages(limit=MAX_PAGE_SIZE, after_id=last_id)
+            if page:
+                # list pages are newest first (and may be a cached list); deliver oldest first
+                page = page[::-1]
+                for q in list(self._subscribers):
+                    try:
+                        for item in page:
+                            q.put_nowait(item)
+                    except asyncio.QueueFull:
+                        self._resync(q)
+                self.delivered += len(page)
+                self._last_id = page[-1]["id"]
+                if len(page) == MAX_PAGE_SIZE:
+                    continue
+            if (self._last_id or 0) >= self._wanted:
+                return
+            # a published id not readable yet (cache or replica lag)
+            await asyncio.sleep(0.05)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "subscribers": len(self._subscribers),
+            "last_id": self._last_id,
+            "delivered": self.delivered,
+            "resyncs": self.resyncs,
+        }
+
+
 app = FastAPI(title="Course App")
-store: Store = create_store()
-
-@app.middleware("http")
-async def add_request_id(request: Request, call_next):
-    req_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:12]
-    REQ_ID_CTX.set(req_id)
-    response = await call_next(request)
-    response.headers["X-Request-ID"] = req_id
-    return response
+store: AsyncStore = create_store()
+compactor = MessageCompactor(RETENTION_MAX_MESSAGES, RETENTION_MAX_AGE_S, COMPACTION_INTERVAL_S, COMPACTION_BATCH)
+broadcaster = MessageBroadcaster(STREAM_QUEUE_SIZE, STREAM_MAX_SUBSCRIBERS, STREAM_POLL_S)
+
+class RequestContextMiddleware:
+    """Pure ASGI middleware: X-Request-ID, Server-Timing and HTTP metrics.
+
+    Unlike @app.middleware("http") (BaseHTTPMiddleware) it runs the endpoint
+    in the same task and passes response messages straight through, so no
+    extra task or memory stream per request and streaming bodies are not
+    re-buffered. Server-Timing is measured up to the response headers:
+    `store` is time spent in store calls, `render` the rest (routing,
+    handler, serialisation), `total` both.
+    """
 
+    def __init__(self, app: Any) -> None:
+        self.app = app
 
-@app.on_event("startup")
-def on_startup():
-    store.init()
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        req_id = ""
+        for key, value in scope["headers"]:
+            if key == b"x-request-id":
+                req_id = value.decode("latin-1")
+                break
+        req_id = req_id or uuid.uuid4().hex[:12]
+        REQ_ID_CTX.set(req_id)
+        timing = {"store": 0.0}
+        REQ_TIMING_CTX.set(timing)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", req_id)
+                if SERVER_TIMING:
+                    total = time.perf_counter() - start
+                    store_s = min(timing["store"], total)
+                    headers.append(
+                        "Server-Timing",
+                        f"store;dur={store_s * 1000:.2f}, render;dur={(total - store_s) * 1000:.2f}, "
+                        f"total;dur={total * 1000:.2f}",
+                    )
+            await send(message)
+
+        if METRICS_ENABLED:
+            HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if METRICS_ENABLED:
+                HTTP_IN_FLIGHT.dec()
+                # label by route template, not raw path, to keep cardinality bounded
+                route = scope.get("route")
+                HTTP_LATENCY.labels(
+                    scope["method"], getattr(route, "path", "unmatched"), str(status)
+                ).observe(time.perf_counter() - start)
 
 
-@app.get("/", response_class=HTMLResponse)
-def index():
-    visits = store.incr_counter("visits", 1)
-    hostname = socket.gethostname()
-    html = f"""
+# gzip dynamic responses above the threshold; it leaves text/event-stream
+# and already-encoded bodies (precompressed static assets) alone. Added
+# first so it sits inside RequestContextMiddleware and Server-Timing
+# includes it
+if COMPRESS_MIN_BYTES > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES, compresslevel=6)
+app.add_middleware(RequestContextMiddleware)
+
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable(request: Request, exc: UpstreamUnavailable):
+    # an open breaker with nothing cached: a quick 503 instead of a 3 s timeout
+    retry_after = str(max(1, math.ceil(HTTP_BREAKER_RESET_S)))
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": retry_after})
+
+
+@app.on_event("startup")
+async def on_startup():
+    await store.init()
+    broadcaster.start()
+    # once per pod, not once per worker
+    if WORKER_ID == 0:
+        compactor.start()
+        app.state.search_backfill = asyncio.create_task(backfill_search_index())
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    stress_engine.cancel_all()
+    if getattr(app.state, "search_backfill", None) is not None:
+        app.state.search_backfill.cancel()
+    await broadcaster.stop()
+    await compactor.stop()
+    await store.close()
+
+
+INDEX_CSS = """\
+:root {
+    --bg:#0b1020;
+    --bg-grad1:#0b1020; /* start */
+    --bg-grad2:#0d1330; /* mid */
+    --bg-grad3:#0a0f28; /* end */
+    --card:#101833cc; /* translucent */
+    --card-border:#28345f80;
+    --text:#e6e8ef;
+    --muted:#a7b0c0;
+    --accent:#7aa2f7;
+    --accent-600:#5d87f6;
+    --accent-700:#4b75ea;
+    --ok:#98c379; --warn:#e5c07b; --err:#e06c75;
+    --ring:#9ab6ff;
+}
+
+* { box-sizing: border-box; }
+html, body { height: 100%; }
+body {
+    font-family: "Inter", system-ui, -apple-system, Segoe UI, Roboto, sans-serif;
+    margin:0;
+    color:var(--text);
+    background:
+        radial-gradient(1200px 600px at 10% -10%, #20327544, transparent 60%),
+        radial-gradient(1000px 500px at 95% 10%, #1b254d55, transparent 60%),
+        linear-gradient(180deg, var(--bg-grad1) 0%, var(--bg-grad2) 40%, var(--bg-grad3) 100%);
+}
+
+.wrap {
+    max-width: 1100px;
+    margin: 0 auto;
+    padding: 32px clamp(20px, 4vw, 40px) 48px;
+}
+
+header.app {
+    display:flex; align-items:flex-start; justify-content:space-between; gap:16px;
+    margin-bottom: 24px;
+}
+h1 { margin: 0; font-size: clamp(28px, 2.4vw, 36px); letter-spacing: -0.015em; }
+p.lead { margin: 8px 0 0 0; color: var(--muted); font-size: 15px; }
+
+.pillbar { margin:12px 0 24px 0; display:flex; flex-wrap:wrap; gap:10px; }
+.badge {
+    display:inline-flex; align-items:center; gap:6px;
+    background: #1b254dcc; color:#dde6ff; padding:7px 12px;
+    border:1px solid #2a376ecc; border-radius:999px; font-size:13px;
+    backdrop-filter: blur(6px);
+}
+
+.grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); gap: 20px; }
+.card {
+    background: var(--card);
+    border:1px solid var(--card-border);
+    border-radius: 16px;
+    padding: 22px;
+    box-shadow: 0 8px 32px rgba(0,0,0,0.35);
+    backdrop-filter: blur(10px);
+}
+.card h3 { margin: 0 0 16px 0; font-size: 18px; font-weight: 600; }
+
+label { display:block; font-size: 13px; font-weight: 500; color: var(--muted); margin-bottom: 8px; }
+input[type=text], input[type=number] {
+    width:100%; background:#0f1736; color:var(--text); font-size: 14px;
+    border:1px solid #2b3970; padding:11px 14px; border-radius:10px;
+    outline: none; transition: box-shadow .15s ease, border-color .15s ease;
+}
+input[type=text]:focus, input[type=number]:focus {
+    border-color: var(--ring);
+    box-shadow: 0 0 0 3px #9ab6ff33;
+}
+
+button {
+    background: linear-gradient(180deg, var(--accent) 0%, var(--accent-600) 90%);
+    border: 1px solid #4569d6;
+    color: #0b1020; font-weight: 700; font-size: 14px; letter-spacing: .01em;
+    padding: 11px 16px; border-radius: 10px; cursor: pointer;
+    transition: transform .06s ease, filter .2s ease, box-shadow .2s ease;
+    box-shadow: 0 6px 18px #2540a855;
+}
+button:hover { filter: brightness(1.02); box-shadow: 0 8px 22px #2540a866; }
+button:active { transform: translateY(1px); }
+button:disabled { opacity: .6; cursor: default; box-shadow:none; }
+
+ul.msgs {
+    list-style:none; padding:0; margin:0;
+    display:flex; flex-direction:column; gap:12px;
+    max-height:300px; overflow-y:auto;
+    scrollbar-width: thin;
+    scrollbar-color: #2b3970 transparent;
+}
+ul.msgs::-webkit-scrollbar { width: 8px; }
+ul.msgs::-webkit-scrollbar-track { background: transparent; }
+ul.msgs::-webkit-scrollbar-thumb { background: #2b3970; border-radius: 4px; }
+ul.msgs::-webkit-scrollbar-thumb:hover { background: #3a4a8a; }
+ul.msgs li { background:#0f1632; border:1px solid #2b3970; padding:14px; border-radius:10px; }
+
+.row { display:flex; gap:12px; align-items:center; flex-wrap:wrap; }
+code { background:#0f1632; border:1px solid #2b3970; padding:4px 9px; border-radius:8px; font-size: 13px; }
+a { color:#9ab6ff; text-decoration: none; }
+a:hover { text-decoration: underline; }
+"""
+
+INDEX_JS = """\
+async function fetchJSON(url, opts={}) {
+  const r = await fetch(url, opts);
+  if (!r.ok) throw new Error(await r.text());
+  return r.json();
+}
+
+const MSG_LIMIT = 50;
+let newestId = 0;
+let msgStream = null;
+
+function renderMessage(it) {
+  const li = document.createElement('li');
+  const dt = new Date(it.created_at || '').toLocaleString();
+  li.innerHTML = `<div style="font-size:12px;color:var(--muted)">#${it.id} • ${dt}</div><div>${(it.text||'')}</div>`;
+  return li;
+}
+
+async function loadMessages() {
+  try {
+    const data = await fetchJSON('/api/messages?limit=' + MSG_LIMIT);
+    const list = document.getElementById('msgList');
+    list.innerHTML = '';
+    for (const it of (data.items || [])) list.appendChild(renderMessage(it));
+    newestId = (data.items && data.items.length) ? data.items[0].id : 0;
+  } catch(e) {
+    console.warn('loadMessages failed', e);
+  }
+}
+
+// new messages arrive over SSE and are prepended; the full list is only
+// fetched once and again when the server asks for a resync
+function prependMessage(it) {
+  if (it.id <= newestId) return;
+  newestId = it.id;
+  const list = document.getElementById('msgList');
+  list.insertBefore(renderMessage(it), list.firstChild);
+  while (list.children.length > MSG_LIMIT) list.removeChild(list.lastChild);
+}
+
+function openStream() {
+  if (!window.EventSource) return;
+  msgStream = new EventSource('/api/messages/stream?after_id=' + newestId);
+  msgStream.onmessage = (e) => prependMessage(JSON.parse(e.data));
+  msgStream.addEventListener('resync', async () => {
+    msgStream.close();
+    await loadMessages();
+    openStream();
+  });
+}
+
+async function refreshVisits() {
+  try {
+    const data = await fetchJSON('/api/counter/visits');
+    document.getElementById('visits').textContent = data.value;
+  } catch { /* ignore */ }
+}
+
+document.getElementById('btnPost').addEventListener('click', async () => {
+  const input = document.getElementById('msgInput');
+  const btn = document.getElementById('btnPost');
+  const st = document.getElementById('msgStatus');
+  const text = (input.value || '').trim();
+  if (!text) return;
+  btn.disabled = true; st.textContent = 'Posting...';
+  try {
+    const body = new URLSearchParams(); body.set('text', text);
+    await fetchJSON('/api/messages', { method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body });
+    input.value=''; st.textContent = 'Posted!';
+    if (!msgStream) await loadMessages();
+    await refreshVisits();
+  } catch(e) {
+    st.textContent = 'Error: ' + (e.message || 'failed');
+  } finally { btn.disabled = false; }
+});
+
+document.getElementById('btnStress').addEventListener('click', async () => {
+  const sec = Math.max(1, Math.min(120, parseInt(document.getElementById('secInput').value || '10')));
+  const st = document.getElementById('stressStatus');
+  st.textContent = 'Starting stress for ' + sec + 's...';
+  try {
+    await fetchJSON(`/stress?seconds=${sec}&background=true`);
+    st.textContent = 'Stress started. Generate load in parallel to see HPA.';
+  } catch(e) { st.textContent = 'Error: ' + (e.message || 'failed'); }
+});
+
+document.getElementById('btnHealth').addEventListener('click', async () => {
+  const st = document.getElementById('hzStatus');
+  try { const x = await fetchJSON('/healthz'); st.textContent = 'Health: ' + x.status; }
+  catch(e) { st.textContent = 'Health error'; }
+});
+document.getElementById('btnReady').addEventListener('click', async () => {
+  const st = document.getElementById('hzStatus');
+  try { const x = await fetchJSON('/readyz'); st.textContent = 'Ready: ' + x.status; }
+  catch(e) { st.textContent = 'Ready error'; }
+});
+
+loadMessages().then(openStream);
+"""
+
+# static shell of the index page; only {visits} changes per request
+INDEX_HTML = """
         <html>
             <head>
                 <title>Course App</title>
@@ -308,120 +3275,19 @@ def index():
                 <link rel="preconnect" href="https://fonts.googleapis.com" />
                 <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin />
                 <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet" />
-                <style>
-                    :root {{
-                        --bg:#0b1020;
-                        --bg-grad1:#0b1020; /* start */
-                        --bg-grad2:#0d1330; /* mid */
-                        --bg-grad3:#0a0f28; /* end */
-                        --card:#101833cc; /* translucent */
-                        --card-border:#28345f80;
-                        --text:#e6e8ef;
-                        --muted:#a7b0c0;
-                        --accent:#7aa2f7;
-                        --accent-600:#5d87f6;
-                        --accent-700:#4b75ea;
-                        --ok:#98c379; --warn:#e5c07b; --err:#e06c75;
-                        --ring:#9ab6ff;
-                    }}
-
-                    * {{ box-sizing: border-box; }}
-                    html, body {{ height: 100%; }}
-                    body {{
-                        font-family: "Inter", system-ui, -apple-system, Segoe UI, Roboto, sans-serif;
-                        margin:0;
-                        color:var(--text);
-                        background:
-                            radial-gradient(1200px 600px at 10% -10%, #20327544, transparent 60%),
-                            radial-gradient(1000px 500px at 95% 10%, #1b254d55, transparent 60%),
-                            linear-gradient(180deg, var(--bg-grad1) 0%, var(--bg-grad2) 40%, var(--bg-grad3) 100%);
-                    }}
-
-                    .wrap {{
-                        max-width: 1100px;
-                        margin: 0 auto;
-                        padding: 32px clamp(20px, 4vw, 40px) 48px;
-                    }}
-
-                    header.app {{
-                        display:flex; align-items:flex-start; justify-content:space-between; gap:16px;
-                        margin-bottom: 24px;
-                    }}
-                    h1 {{ margin: 0; font-size: clamp(28px, 2.4vw, 36px); letter-spacing: -0.015em; }}
-                    p.lead {{ margin: 8px 0 0 0; color: var(--muted); font-size: 15px; }}
-
-                    .pillbar {{ margin:12px 0 24px 0; display:flex; flex-wrap:wrap; gap:10px; }}
-                    .badge {{
-                        display:inline-flex; align-items:center; gap:6px;
-                        background: #1b254dcc; color:#dde6ff; padding:7px 12px;
-                        border:1px solid #2a376ecc; border-radius:999px; font-size:13px;
-                        backdrop-filter: blur(6px);
-                    }}
-
-                    .grid {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); gap: 20px; }}
-                    .card {{
-                        background: var(--card);
-                        border:1px solid var(--card-border);
-                        border-radius: 16px;
-                        padding: 22px;
-                        box-shadow: 0 8px 32px rgba(0,0,0,0.35);
-                        backdrop-filter: blur(10px);
-                    }}
-                    .card h3 {{ margin: 0 0 16px 0; font-size: 18px; font-weight: 600; }}
-
-                    label {{ display:block; font-size: 13px; font-weight: 500; color: var(--muted); margin-bottom: 8px; }}
-                    input[type=text], input[type=number] {{
-                        width:100%; background:#0f1736; color:var(--text); font-size: 14px;
-                        border:1px solid #2b3970; padding:11px 14px; border-radius:10px;
-                        outline: none; transition: box-shadow .15s ease, border-color .15s ease;
-                    }}
-                    input[type=text]:focus, input[type=number]:focus {{
-                        border-color: var(--ring);
-                        box-shadow: 0 0 0 3px #9ab6ff33;
-                    }}
-
-                    button {{
-                        background: linear-gradient(180deg, var(--accent) 0%, var(--accent-600) 90%);
-                        border: 1px solid #4569d6;
-                        color: #0b1020; font-weight: 700; font-size: 14px; letter-spacing: .01em;
-                        padding: 11px 16px; border-radius: 10px; cursor: pointer;
-                        transition: transform .06s ease, filter .2s ease, box-shadow .2s ease;
-                        box-shadow: 0 6px 18px #2540a855;
-                    }}
-                    button:hover {{ filter: brightness(1.02); box-shadow: 0 8px 22px #2540a866; }}
-                    button:active {{ transform: translateY(1px); }}
-                    button:disabled {{ opacity: .6; cursor: default; box-shadow:none; }}
-
-                    ul.msgs {{
-                        list-style:none; padding:0; margin:0;
-                        display:flex; flex-direction:column; gap:12px;
-                        max-height:300px; overflow-y:auto;
-                        scrollbar-width: thin;
-                        scrollbar-color: #2b3970 transparent;
-                    }}
-                    ul.msgs::-webkit-scrollbar {{ width: 8px; }}
-                    ul.msgs::-webkit-scrollbar-track {{ background: transparent; }}
-                    ul.msgs::-webkit-scrollbar-thumb {{ background: #2b3970; border-radius: 4px; }}
-                    ul.msgs::-webkit-scrollbar-thumb:hover {{ background: #3a4a8a; }}
-                    ul.msgs li {{ background:#0f1632; border:1px solid #2b3970; padding:14px; border-radius:10px; }}
-
-                    .row {{ display:flex; gap:12px; align-items:center; flex-wrap:wrap; }}
-                    code {{ background:#0f1632; border:1px solid #2b3970; padding:4px 9px; border-radius:8px; font-size: 13px; }}
-                    a {{ color:#9ab6ff; text-decoration: none; }}
-                    a:hover {{ text-decoration: underline; }}
-                </style>
+                <link href="{css_url}" rel="stylesheet" />
             </head>
       <body>
                 <div class="wrap">
                     <header class="app">
                         <div>
                             <h1>Docker & Kubernetes Course App</h1>
-                            <p class="lead">{APP_MESSAGE}</p>
+                            <p class="lead">{app_message}</p>
                         </div>
                     </header>
                     <div class="pillbar">
                         <span class="badge">pod: {hostname}</span>
-                        <span class="badge">store: {store.name}</span>
+                        <span class="badge">store: {store}</span>
                         <span class="badge">visits: <span id="visits">{visits}</span></span>
                     </div>
 
@@ -461,112 +3327,147 @@ def index():
           </div>
         </div>
 
-        <script>
-          async function fetchJSON(url, opts={{}}) {{
-            const r = await fetch(url, opts);
-            if (!r.ok) throw new Error(await r.text());
-            return r.json();
-          }}
-
-          async function loadMessages() {{
-            try {{
-              const data = await fetchJSON('/api/messages?limit=50');
-              const list = document.getElementById('msgList');
-              list.innerHTML = '';
-              for (const it of (data.items || [])) {{
-                const li = document.createElement('li');
-                const dt = new Date(it.created_at || '').toLocaleString();
-                li.innerHTML = `<div style="font-size:12px;color:var(--muted)">#${{it.id}} • ${{dt}}</div><div>${{(it.text||'')}}</div>`;
-                list.appendChild(li);
-              }}
-            }} catch(e) {{
-              console.warn('loadMessages failed', e);
-            }}
-          }}
-
-          async function refreshVisits() {{
-            try {{
-              const data = await fetchJSON('/api/counter/visits');
-              document.getElementById('visits').textContent = data.value;
-            }} catch {{ /* ignore */ }}
-          }}
-
-          document.getElementById('btnPost').addEventListener('click', async () => {{
-            const input = document.getElementById('msgInput');
-            const btn = document.getElementById('btnPost');
-            const st = document.getElementById('msgStatus');
-            const text = (input.value || '').trim();
-            if (!text) return;
-            btn.disabled = true; st.textContent = 'Posting...';
-            try {{
-              const body = new URLSearchParams(); body.set('text', text);
-              await fetchJSON('/api/messages', {{ method:'POST', headers:{{'Content-Type':'application/x-www-form-urlencoded'}}, body }});
-              input.value=''; st.textContent = 'Posted!';
-              await loadMessages(); await refreshVisits();
-            }} catch(e) {{
-              st.textContent = 'Error: ' + (e.message || 'failed');
-            }} finally {{ btn.disabled = false; }}
-          }});
-
-          document.getElementById('btnStress').addEventListener('click', async () => {{
-            const sec = Math.max(1, Math.min(120, parseInt(document.getElementById('secInput').value || '10')));
-            const st = document.getElementById('stressStatus');
-            st.textContent = 'Starting stress for ' + sec + 's...';
-            try {{
-              await fetchJSON(`/stress?seconds=${{sec}}&background=true`);
-              st.textContent = 'Stress started. Generate load in parallel to see HPA.';
-            }} catch(e) {{ st.textContent = 'Error: ' + (e.message || 'failed'); }}
-          }});
-
-          document.getElementById('btnHealth').addEventListener('click', async () => {{
-            const st = document.getElementById('hzStatus');
-            try {{ const x = await fetchJSON('/healthz'); st.textContent = 'Health: ' + x.status; }}
-            catch(e) {{ st.textContent = 'Health error'; }}
-          }});
-          document.getElementById('btnReady').addEventListener('click', async () => {{
-            const st = document.getElementById('hzStatus');
-            try {{ const x = await fetchJSON('/readyz'); st.textContent = 'Ready: ' + x.status; }}
-            catch(e) {{ st.textContent = 'Ready error'; }}
-          }});
-
-          loadMessages();
-        </script>
+        <script src="{js_url}"></script>
       </body>
     </html>
-    """
-    return HTMLResponse(content=html)
+"""
+
+
+def _pick_encoding(accept_encoding: str, available: Dict[str, bytes]) -> str:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+class StaticAsset:
+    """In-memory static file served under a content-hash name with
+    precomputed gzip (and brotli, when installed) variants."""
+
+    def __init__(self, name: str, ext: str, content_type: str, body: str) -> None:
+        raw = body.encode()
+        digest = hashlib.sha256(raw).hexdigest()[:12]
+        self.filename = f"{name}.{digest}.{ext}"
+        self.url = f"/static/{self.filename}"
+        self.content_type = content_type
+        self.etag = f'"{digest}"'
+        self.variants = {"identity": raw, "gzip": gzip.compress(raw, 9)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(raw, quality=11)
+
+    def response(self, request: Request) -> Response:
+        headers = {
+            # the name changes with the content, so clients may keep it forever
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": self.etag,
+            "Vary": "Accept-Encoding",
+        }
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=304, headers=headers)
+        encoding = _pick_encoding(request.headers.get("accept-encoding", ""), self.variants)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.content_type, headers=headers)
+
+
+INDEX_CSS_ASSET = StaticAsset("app", "css", "text/css; charset=utf-8", INDEX_CSS)
+INDEX_JS_ASSET = StaticAsset("app", "js", "application/javascript; charset=utf-8", INDEX_JS)
+STATIC_ASSETS = {a.filename: a for a in (INDEX_CSS_ASSET, INDEX_JS_ASSET)}
+
+# render everything except the visits count once per process
+_VISITS_MARK = "\0visits\0"
+INDEX_HEAD, INDEX_TAIL = (
+    part.encode()
+    for part in INDEX_HTML.format(
+        app_message=APP_MESSAGE,
+        hostname=HOSTNAME,
+        store=store.name,
+        visits=_VISITS_MARK,
+        css_url=INDEX_CSS_ASSET.url,
+        js_url=INDEX_JS_ASSET.url,
+    ).split(_VISITS_MARK)
+)
+
+
+def _etag(*parts: Any) -> str:
+    # weak: the same entity may go out gzip-encoded or not
+    return 'W/"%s"' % hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+@app.get("/", response_class=HTMLResponse)
+async def index():
+    visits = await store.incr_counter("visits", 1)
+    return HTMLResponse(
+        content=INDEX_HEAD + str(visits).encode() + INDEX_TAIL,
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/static/{filename}")
+async def static_asset(filename: str, request: Request):
+    asset = STATIC_ASSETS.get(filename)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return asset.response(request)
 
 
 @app.get("/api/counter/{name}")
-def api_counter(name: str):
+async def api_counter(name: str, request: Request):
     try:
-        val = store.get_counter(name)
-        return {"name": name, "value": val}
+        val = await store.get_counter(name)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # the value is its own version
+    headers = {"Cache-Control": "no-cache", "ETag": _etag(name, val)}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"name": name, "value": val}, headers=headers)
 
 
 @app.get("/healthz")
-def healthz():
+async def healthz():
     return {"status": "ok"}
 
 
 @app.get("/readyz")
-def readyz():
+async def readyz():
     try:
         # check store accessibility
-        store.ping()
+        await store.ping()
         return {"status": "ready"}
     except Exception as e:
         return JSONResponse(status_code=503, content={"status": "not-ready", "error": str(e)})
 
 
 @app.get("/api/info")
-def info():
+async def info():
     hostname = socket.gethostname()
+    store_stats = dict(store.stats())
+    if WORKER_ID != 0:
+        # compaction and the search backfill run only in worker 0; another
+        # worker's numbers for them would just be its own idle copy
+        store_stats.pop("search_backfill_pending", None)
     return {
         "app": "course-app",
         "hostname": hostname,
+        "worker": WORKER_ID,
         "store": store.name,
         "db_path": DB_PATH,
         "redis_url": REDIS_URL if getattr(store, 'name', '') == 'redis' else "",
@@ -574,39 +3475,572 @@ def info():
         "counter_api": COUNTER_API if getattr(store, 'name', '') == 'http' else "",
         "message": APP_MESSAGE,
         "secret_token_present": bool(SECRET_TOKEN),
+        "store_stats": store_stats,
+        "compaction": compactor.to_dict() if WORKER_ID == 0 else None,
+        "stream": broadcaster.to_dict(),
         "env": {k: v for k, v in os.environ.items() if k.startswith("APP_")},
     }
 
 
 @app.get("/api/messages")
-def get_messages(limit: int = 20):
-    return {"items": store.list_messages(limit=limit)}
+async def get_messages(
+    request: Request, limit: int = 20, before_id: int | None = None, after_id: int | None = None
+):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="use either before_id or after_id")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    headers = {"Cache-Control": "no-cache"}
+    # read the version before the page, so a write in between can only
+    # make the tag older than the body, never newer
+    version = await store.messages_version()
+    if version is not None:
+        headers["ETag"] = _etag(version, limit, before_id, after_id)
+        if _not_modified(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    items = await store.list_messages(limit=limit, before_id=before_id, after_id=after_id)
+    # pass next_cursor back in the same parameter to continue in that direction
+    next_cursor = None
+    if len(items) == limit:
+        next_cursor = items[0]["id"] if after_id is not None else items[-1]["id"]
+    response = JSONResponse({"items": items, "next_cursor": next_cursor}, headers=headers)
+    if version is None:
+        # no version token (http store): tag the body, which still saves the transfer
+        etag = _etag(response.body)
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={**headers, "ETag": etag})
+        response.headers["ETag"] = etag
+    return response
+
+
+@app.get("/api/messages/search")
+async def search_messages(q: str = "", limit: int = 20, offset: int = 0):
+    if not search_tokens(q):
+        raise HTTPException(status_code=400, detail="q is required")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    try:
+        items = await store.search_messages(q, limit=limit, offset=offset)
+    except NotImplementedError:
+        raise HTTPException(status_code=501, detail=f"search is not supported by the {store.name} store")
+    # ranked results page by offset; pass next_offset back as offset
+    next_offset = offset + limit if len(items) == limit else None
+    return {"items": items, "next_offset": next_offset}
 
 
 @app.post("/api/messages")
-def post_message(text: str | None = Form(None), qtext: str | None = Query(None)):
+async def post_message(text: str | None = Form(None), qtext: str | None = Query(None)):
     # Accept both form-encoded (preferred) and query param for flexibility
     t = text or qtext
     if not t or not t.strip():
         raise HTTPException(status_code=400, detail="text is required")
-    store.add_message(t.strip())
+    await store.add_message(t.strip())
+    broadcaster.notify()
     return {"status": "created"}
 
 
-def _burn_cpu(seconds: int):
-    end = time.time() + seconds
-    x = 0.0001
-    while time.time() < end:
-        x = math.sqrt(x) ** 2 + math.sin(x)  # meaningless math
+def _parse_batch(body: bytes, content_type: str) -> List[str]:
+    # JSON array or NDJSON; items are strings or {"text": ...} objects
+    if content_type.startswith("application/x-ndjson"):
+        items = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        items = json.loads(body)
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON array")
+    texts: List[str] = []
+    for i, it in enumerate(items):
+        t = it.get("text") if isinstance(it, dict) else it
+        if not isinstance(t, str) or not t.strip():
+            raise ValueError(f"item {i}: text is required")
+        texts.append(t.strip())
+    return texts
+
+
+@app.post("/api/messages/batch")
+async def post_messages_batch(request: Request):
+    try:
+        texts = _parse_batch(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:  # json.JSONDecodeError is a ValueError too
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(texts) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"at most {MAX_BATCH_SIZE} messages per batch")
+    ids = await store.add_messages(texts)
+    broadcaster.notify(ids[-1] if ids else None)
+    return {"status": "created", "ids": ids}
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+async def _encode_export(batches: AsyncIterator[List[Dict[str, Any]]], fmt: str) -> AsyncIterator[bytes]:
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["id", "text", "created_at"])
+        async for batch in batches:
+            for it in batch:
+                writer.writerow([it["id"], it["text"], it["created_at"]])
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode()
+    else:
+        async for batch in batches:
+            yield "".join(json.dumps(it, ensure_ascii=False) + "\n" for it in batch).encode()
+
+
+async def _primed(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # pull the first chunk before the response starts, so backend errors still
+    # turn into a proper status code instead of a truncated 200
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+
+    async def body() -> AsyncIterator[bytes]:
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return body()
+
+
+@app.get("/api/messages/export")
+async def export_messages(format: str = "ndjson"):
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    chunks = store.export_stream(format)
+    if chunks is None:
+        chunks = _encode_export(store.export_messages(EXPORT_BATCH_SIZE), format)
+    try:
+        body = await _primed(chunks)
+    except Exception as e:
+        raise HTTPException(status_code=502 if store.name == "http" else 500, detail=str(e))
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="messages.{format}"'},
+    )
+
+
+async def _message_feed(
+    q: "asyncio.Queue[Optional[Dict[str, Any]]]", after_id: Optional[int], heartbeat_s: float
+) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    # messages newer than after_id, oldest first; None = resync (reload the
+    # list), {} = nothing new for heartbeat_s
+    sent = after_id or 0
+    if after_id is not None:
+        # catch up on what was missed before the subscription; a client that
+        # is further behind than one page reloads instead
+        missed = await store.list_messages(limit=MAX_PAGE_SIZE, after_id=after_id)
+        if len(missed) >= MAX_PAGE_SIZE:
+            yield None
+            return
+        for item in reversed(missed):
+            sent = item["id"]
+            yield item
+    while True:
+        try:
+            item = await asyncio.wait_for(q.get(), heartbeat_s or None)
+        except asyncio.TimeoutError:
+            yield {}
+            continue
+        if item is None:
+            yield None
+            return
+        # the catch-up page and the queue overlap around the subscription
+        if item["id"] > sent:
+            sent = item["id"]
+            yield item
+
+
+def _sse_event(item: Dict[str, Any]) -> bytes:
+    return f"id: {item['id']}\ndata: {json.dumps(item, ensure_ascii=False)}\n\n".encode()
+
+
+@app.get("/api/messages/stream")
+async def stream_messages(request: Request, after_id: Optional[int] = None):
+    # EventSource sends the last id it received when it reconnects
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after_id = int(last_event_id)
+    q = await broadcaster.subscribe()
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            yield b"retry: 3000\n\n"
+            async for item in _message_feed(q, after_id, STREAM_HEARTBEAT_S):
+                if item is None:
+                    yield b"event: resync\ndata: {}\n\n"
+                    return
+                # comment lines keep proxies from closing an idle stream and
+                # surface a gone client at the next write
+                yield _sse_event(item) if item else b": ping\n\n"
+        finally:
+            broadcaster.unsubscribe(q)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/api/messages/ws")
+async def messages_ws(websocket: WebSocket, after_id: Optional[int] = None):
+    try:
+        q = await broadcaster.subscribe()
+    except HTTPException:
+        await websocket.close(code=1013)  # try again later
+        return
+    await websocket.accept()
+
+    async def send() -> None:
+        async for item in _message_feed(q, after_id, STREAM_HEARTBEAT_S):
+            if item is None:
+                await websocket.send_json({"event": "resync"})
+                await websocket.close()
+                break
+            if item:
+                await websocket.send_json(item)
+        tg.cancel_scope.cancel()
+
+    async def receive() -> None:
+        # nothing is expected from the client; this only notices it leaving
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+        tg.cancel_scope.cancel()
+
+    try:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(send)
+            tg.start_soon(receive)
+    finally:
+        broadcaster.unsubscribe(q)
+
+
+@app.get("/metrics")
+async def metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="metrics disabled")
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    THREADPOOL_BUSY.labels("default").set(limiter.borrowed_tokens)
+    THREADPOOL_SIZE.labels("default").set(limiter.total_tokens)
+    threads = store.stats().get("store_threads")
+    if threads:
+        THREADPOOL_BUSY.labels("store").set(threads["busy"])
+        THREADPOOL_SIZE.labels("store").set(threads["size"])
+    return Response(prometheus_client.generate_latest(), media_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+def cpu_quota() -> int:
+    """CPUs this container may use: the cgroup CPU quota if one is set,
+    otherwise the scheduler affinity mask (not the host core count)."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            q, p = f.read().split()[:2]
+            if q != "max":
+                quota = int(q) / int(p)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                q = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                p = int(f.read())
+            if q > 0 and p > 0:
+                quota = q / p
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+STRESS_MODES = {
+    # mode: (worker, unit of target/achieved, how worker progress combines)
+    "cpu": (stress.cpu_worker, "%", "mean"),
+    "memory": (stress.memory_worker, "MB", "sum"),
+    "io": (stress.io_worker, "MB/s", "sum"),
+}
+
+
+class StressJob:
+    """One /stress run: worker processes sharing a cancel event.
+
+    cpu uses one process per core; memory and io use a single process.
+    """
+
+    def __init__(self, mode: str, seconds: int, cores: int, target: float, ramp: int) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        worker, self.unit, self._combine = STRESS_MODES[mode]
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.seconds = seconds
+        self.cores = cores if mode == "cpu" else 1
+        self.target = target
+        self.ramp = ramp
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = ctx.Event()
+        self._progress = [ctx.Value("d", 0.0, lock=False) for _ in range(self.cores)]
+        scratch = os.path.join(os.path.dirname(DB_PATH) or ".", f".stress-{self.id}")
+        self._procs = [
+            ctx.Process(
+                target=worker,
+                args=(seconds, target, ramp, self._cancel, progress, f"{scratch}-{i}.tmp"),
+                daemon=True,
+            )
+            for i, progress in enumerate(self._progress)
+        ]
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        for p in self._procs:
+            p.start()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def running(self) -> bool:
+        if self.started_at is None or self.finished_at is not None:
+            return False
+        # is_alive() also reaps finished workers
+        if any(p.is_alive() for p in self._procs):
+            return True
+        self.finished_at = time.time()
+        return False
+
+    def achieved(self) -> float:
+        values = [p.value for p in self._progress]
+        total = sum(values)
+        return total / len(values) if self._combine == "mean" else total
+
+    def to_dict(self) -> Dict[str, Any]:
+        running = self.running
+        if self.started_at is None:
+            status = "pending"
+        elif running:
+            status = "cancelling" if self._cancel.is_set() else "running"
+        else:
+            status = "cancelled" if self._cancel.is_set() else "done"
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        if self.ramp > 0:
+            current_target = self.target * min(1.0, elapsed / self.ramp)
+        else:
+            current_target = self.target
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "status": status,
+            "seconds": self.seconds,
+            "cores": self.cores,
+            "ramp": self.ramp,
+            "unit": self.unit,
+            "target": self.target,
+            "current_target": round(current_target, 2),
+            "achieved": round(self.achieved(), 2),
+            "elapsed": round(elapsed, 3),
+        }
+
+
+class StressEngine:
+    """Registry of stress jobs with a cap on how many run at once."""
+
+    def __init__(self, max_jobs: int, keep_finished: int = 50) -> None:
+        self.max_jobs = max(1, max_jobs)
+        self.keep_finished = keep_finished
+        self.jobs: "OrderedDict[str, StressJob]" = OrderedDict()
+
+    def submit(self, job: StressJob) -> StressJob:
+        # jobs that are not finished yet (including ones still spawning) count
+        active = [j for j in self.jobs.values() if j.running or j.started_at is None]
+        if len(active) >= self.max_jobs:
+            raise RuntimeError(f"at most {self.max_jobs} stress jobs may run at once")
+        finished = [i for i, j in self.jobs.items() if j.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+        self.jobs[job.id] = job
+        return job
+
+    def cancel_all(self) -> None:
+        for job in self.jobs.values():
+            job.cancel()
+
+
+stress_engine = StressEngine(STRESS_MAX_JOBS)
 
 
 @app.get("/stress")
-def stress(seconds: int = 10, background: bool = True):
-    seconds = max(1, min(seconds, 120))
+async def stress(
+    seconds: int = 10,
+    background: bool = True,
+    mode: str = "cpu",
+    cores: int = 1,
+    utilization: int = Query(100, ge=1, le=100),
+    mb: int = Query(100, ge=1),
+    ramp: int = Query(0, ge=0),
+):
+    if mode not in STRESS_MODES:
+        raise HTTPException(status_code=400, detail="mode must be cpu, memory or io")
+    seconds = max(1, min(seconds, STRESS_MAX_SECONDS))
+    cores = max(1, min(cores, cpu_quota()))
+    # cpu targets a utilisation %, memory a resident size in MB, io a write rate in MB/s
+    target = float(utilization) if mode == "cpu" else float(min(mb, STRESS_MAX_MB))
+    try:
+        job = stress_engine.submit(StressJob(mode, seconds, cores, target, min(ramp, seconds)))
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    # spawning interpreters takes a while, keep it off the event loop
+    await anyio.to_thread.run_sync(job.start)
     if background:
-        t = threading.Thread(target=_burn_cpu, args=(seconds,), daemon=True)
-        t.start()
-        return {"status": "started", "seconds": seconds}
+        return job.to_dict()
+    while job.running:
+        await asyncio.sleep(0.2)
+    return job.to_dict()
+
+
+@app.get("/stress/{job_id}")
+async def stress_status(job_id: str):
+    job = stress_engine.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown stress job")
+    return job.to_dict()
+
+
+@app.delete("/stress/{job_id}")
+async def stress_cancel(job_id: str):
+    job = stress_engine.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown stress job")
+    job.cancel()
+    return job.to_dict()
+
+
+def _listen_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(worker_id: int, host: str, port: int, shared: Optional[socket.socket]) -> None:
+    global store, WORKER_ID
+    import uvicorn  # only the launcher needs it; `uvicorn src.main:app` imports this module itself
+
+    WORKER_ID = worker_id
+    # fresh clients and pools in every worker: connections must not be shared across fork
+    store = create_store()
+    sock = shared if shared is not None else _listen_socket(host, port, reuse_port=True)
+    config = uvicorn.Config(app, log_level=os.getenv("APP_LOG_LEVEL", "info"))
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(argv: Optional[List[str]] = None) -> None:
+    """Run the app in N worker processes on one port: `python src/main.py`.
+
+    The schema is created once here, before any worker is forked. Each worker
+    then opens its own store clients and its own SO_REUSEPORT socket on the
+    same port, so the kernel spreads connections evenly across them (without
+    SO_REUSEPORT they all accept from one inherited socket). A worker that
+    dies is forked again; SIGTERM/SIGINT shut all of them down gracefully.
+    """
+    global STORE_SCHEMA_READY
+    ap = argparse.ArgumentParser(description="Course App launcher")
+    ap.add_argument("--host", default=os.getenv("APP_HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("APP_PORT", "8080")))
+    ap.add_argument(
+        "--workers", type=int, default=int(os.getenv("APP_WORKERS", "0")), help="0 = the container's CPU quota"
+    )
+    args = ap.parse_args(argv)
+    workers = args.workers if args.workers > 0 else cpu_quota()
+
+    if STORE_BACKEND == "memory" and not (MESSAGES_API or COUNTER_API):
+        # every process would have its own, diverging copy of the data
+        if workers > 1:
+            print("course-app: APP_STORE=memory runs a single worker", file=sys.stderr, flush=True)
+        workers = 1
     else:
-        _burn_cpu(seconds)
-        return {"status": "done", "seconds": seconds}
+        setup = create_sync_store()
+        try:
+            setup.init()
+        finally:
+            setup.close()
+        STORE_SCHEMA_READY = True
+
+    reuse_port = hasattr(socket, "SO_REUSEPORT")
+    shared = None if reuse_port else _listen_socket(args.host, args.port, reuse_port=False)
+    children: Dict[int, tuple] = {}  # pid -> (worker slot, fork time)
+    stopping = False
+
+    def spawn(worker_id: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                _run_worker(worker_id, args.host, args.port, shared)
+            except BaseException:
+                import traceback
+
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        children[pid] = (worker_id, time.monotonic())
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(
+        f"course-app: {workers} worker(s) on {args.host}:{args.port}"
+        f"{' (SO_REUSEPORT)' if reuse_port else ''}",
+        file=sys.stderr,
+        flush=True,
+    )
+    for worker_id in range(workers):
+        spawn(worker_id)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id, started = children.pop(pid, (None, 0.0))
+        if worker_id is None or stopping:
+            continue
+        print(
+            f"course-app: worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting",
+            file=sys.stderr,
+            flush=True,
+        )
+        # a worker that cannot even start (port taken, bad config) should not spin
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+            if stopping:
+                continue
+        spawn(worker_id)
+
+
+if __name__ == "__main__":
+    # spawned /stress workers would otherwise run this whole script again (app,
+    # store, assets) before starting; they only need the stress module
+    del __file__
+    serve()
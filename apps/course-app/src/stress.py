@@ -0,0 +1,87 @@
+"""Worker processes for /stress: cpu, memory and io load.
+
+multiprocessing's spawn start method imports this module in every child, so
+it must stay free of app side effects (no FastAPI app, no store, no assets).
+"""
+import math
+import os
+import time
+from typing import Any, List
+
+
+# each worker ticks every STRESS_TICK seconds and publishes what it achieved
+# so far in `progress`: average utilisation %, MB held, or average MB/s
+STRESS_TICK = 0.1
+STRESS_IO_WRAP_MB = 256  # io mode rewrites its scratch file from the start past this size
+
+
+def _ramped(target: float, ramp: float, started: float) -> float:
+    if ramp <= 0:
+        return target
+    return target * min(1.0, (time.monotonic() - started) / ramp)
+
+
+def cpu_worker(seconds: float, target: float, ramp: float, cancel: Any, progress: Any, path: str) -> None:
+    # duty cycle: spin for `target`% of every tick, sleep the rest
+    started = time.monotonic()
+    end = started + seconds
+    busy_total = 0.0
+    x = 0.0001
+    while time.monotonic() < end and not cancel.is_set():
+        tick = time.monotonic()
+        busy = STRESS_TICK * _ramped(target, ramp, started) / 100.0
+        while time.monotonic() - tick < busy:
+            x = math.sqrt(x) ** 2 + math.sin(x)  # meaningless math
+        busy_total += time.monotonic() - tick
+        progress.value = 100.0 * busy_total / max(time.monotonic() - started, 1e-9)
+        idle = STRESS_TICK - (time.monotonic() - tick)
+        if idle > 0:
+            cancel.wait(idle)
+
+
+def memory_worker(seconds: float, target: float, ramp: float, cancel: Any, progress: Any, path: str) -> None:
+    # allocate 1 MB blocks and write to every page so they count towards RSS
+    started = time.monotonic()
+    end = started + seconds
+    blocks: List[bytearray] = []
+    page = 4096
+    while time.monotonic() < end and not cancel.is_set():
+        want = int(_ramped(target, ramp, started))
+        while len(blocks) < want:
+            block = bytearray(1024 * 1024)
+            block[::page] = b"\x01" * (len(block) // page)
+            blocks.append(block)
+        progress.value = float(len(blocks))
+        cancel.wait(STRESS_TICK)
+    blocks.clear()
+    progress.value = 0.0
+
+
+def io_worker(seconds: float, target: float, ramp: float, cancel: Any, progress: Any, path: str) -> None:
+    # write and fsync the ramped MB/s every tick into a scratch file
+    chunk = os.urandom(256 * 1024)
+    started = time.monotonic()
+    end = started + seconds
+    written = 0
+    due = 0.0
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        while time.monotonic() < end and not cancel.is_set():
+            tick = time.monotonic()
+            due += _ramped(target, ramp, started) * 1024 * 1024 * STRESS_TICK
+            while due >= len(chunk) and time.monotonic() - tick < STRESS_TICK:
+                if os.lseek(fd, 0, os.SEEK_CUR) >= STRESS_IO_WRAP_MB * 1024 * 1024:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                written += os.write(fd, chunk)
+                due -= len(chunk)
+            os.fsync(fd)
+            # do not bank more than one tick of debt when the disk falls behind
+            due = min(due, target * 1024 * 1024 * STRESS_TICK)
+            progress.value = written / (1024 * 1024) / max(time.monotonic() - started, 1e-9)
+            idle = STRESS_TICK - (time.monotonic() - tick)
+            if idle > 0:
+                cancel.wait(idle)
+    finally:
+        os.close(fd)
+        os.unlink(path)
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# main reads its config at import time
+os.environ.setdefault("APP_DB_PATH", os.path.join(tempfile.mkdtemp(), "import.db"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,34 @@
+"""Route behaviour that depends on more than one store call."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+    path = str(tmp_path / "app.db")
+    cached = main.CachedMessagesStore(main.ThreadedAsyncStore(main.SqliteStore(path)), 60_000, 64)
+    monkeypatch.setattr(main, "store", cached)
+    # a second worker on the same database, whose writes this process never hears about
+    other = main.SqliteStore(path)
+    with TestClient(main.app) as client:
+        other.init()
+        yield client, other
+    other.close()
+
+
+def test_etag_never_pairs_a_new_version_with_a_cached_page(sqlite_app):
+    client, other = sqlite_app
+    client.post("/api/messages", data={"text": "one"})
+    first = client.get("/api/messages?limit=5")
+    assert [it["text"] for it in first.json()["items"]] == ["one"]
+
+    other.add_message("two")
+    second = client.get("/api/messages?limit=5", headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert [it["text"] for it in second.json()["items"]] == ["two", "one"]
+    assert second.headers["etag"] != first.headers["etag"]
+
+    third = client.get("/api/messages?limit=5", headers={"If-None-Match": second.headers["etag"]})
+    assert third.status_code == 304
@@ -0,0 +1,392 @@
+"""HttpStore / AsyncHttpStore resilience against upstreams faked with httpx.MockTransport."""
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+COUNTER_API = "http://counter/api"
+
+
+@pytest.fixture(autouse=True)
+def upstream_config(monkeypatch):
+    # small, fast settings; tests override what they exercise
+    monkeypatch.setattr(main, "HTTP_BREAKER_FAILURES", 2)
+    monkeypatch.setattr(main, "HTTP_BREAKER_RESET_S", 0.05)
+    monkeypatch.setattr(main, "HTTP_READ_RETRIES", 0)
+    monkeypatch.setattr(main, "HTTP_RETRY_BACKOFF_MS", 0)
+    monkeypatch.setattr(main, "HTTP_HEDGE", False)
+    monkeypatch.setattr(main, "HTTP_COALESCE", True)
+
+
+class Upstream:
+    """Counter service stub: answers 503 while `down`, counts requests."""
+
+    def __init__(self) -> None:
+        self.down = False
+        self.requests = 0
+        self.value = 7
+        self._lock = threading.Lock()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+        if self.down:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"value": self.value})
+
+
+def http_store(handler) -> "main.HttpStore":
+    store = main.HttpStore(None, COUNTER_API)
+    store.counter_client.close()
+    store.counter_client = httpx.Client(transport=httpx.MockTransport(handler))
+    return store
+
+
+async def async_http_store(handler) -> "main.AsyncHttpStore":
+    store = main.AsyncHttpStore(None, COUNTER_API)
+    await store.counter_client.aclose()
+    store.counter_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return store
+
+
+def test_breaker_opens_probes_once_and_closes():
+    breaker = main.CircuitBreaker("counter", threshold=2, reset_s=0.05)
+    breaker.failure()
+    assert breaker.allow() and breaker.state == "closed"
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    # one probe after reset_s, everyone else is still rejected
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.failures == 0 and breaker.allow()
+    assert breaker.to_dict() == {"state": "closed", "failures": 0, "trips": 1, "rejected": 2}
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = main.CircuitBreaker("counter", threshold=2, reset_s=0.05)
+    breaker.failure()
+    breaker.failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and breaker.trips == 2
+    assert not breaker.allow()
+
+
+def test_http_store_breaker_cycle():
+    upstream = Upstream()
+    store = http_store(upstream)
+    upstream.down = True
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            store.get_counter("hits")
+    assert store.breakers["counter"].state == "open"
+    # open: fail fast without calling the upstream
+    with pytest.raises(main.UpstreamUnavailable):
+        store.get_counter("hits")
+    assert upstream.requests == 2
+
+    upstream.down = False
+    time.sleep(0.06)
+    assert store.get_counter("hits") == 7
+    assert store.breakers["counter"].state == "closed"
+    assert upstream.requests == 3
+    store.close()
+
+
+def test_open_breaker_serves_the_last_good_value():
+    upstream = Upstream()
+    store = http_store(upstream)
+    assert store.get_counter("hits") == 7
+    upstream.down = True
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            store.get_counter("hits")
+    upstream.value = 8
+    assert store.get_counter("hits") == 7
+    assert store.stale_served == 1
+    # other keys have nothing to fall back to
+    with pytest.raises(main.UpstreamUnavailable):
+        store.get_counter("other")
+    store.close()
+
+
+def test_open_breaker_without_a_cached_value_is_a_503_with_retry_after(monkeypatch):
+    upstream = Upstream()
+    upstream.down = True
+    store = asyncio.run(async_http_store(upstream))
+    monkeypatch.setattr(main, "store", store)
+    with TestClient(main.app) as client:
+        for _ in range(2):
+            assert client.get("/api/counter/hits").status_code == 500
+        r = client.get("/api/counter/hits")
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+    assert "circuit open" in r.json()["detail"]
+    assert upstream.requests == 2
+
+
+def test_cancelled_probe_hands_the_probe_to_the_next_caller(monkeypatch):
+    # without coalescing the caller's cancel reaches the request itself
+    monkeypatch.setattr(main, "HTTP_COALESCE", False)
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def handler(request):
+            await gate.wait()
+            return httpx.Response(200, json={"value": 1})
+
+        store = await async_http_store(handler)
+        breaker = store.breakers["counter"]
+        breaker.failure()
+        breaker.failure()
+        await asyncio.sleep(0.06)
+        probe = asyncio.ensure_future(store.get_counter("hits"))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        # no verdict: still open, failures untouched, and the next caller probes
+        assert breaker.to_dict()["state"] == "open" and breaker.failures == 2
+        gate.set()
+        assert await store.get_counter("hits") == 1
+        assert breaker.state == "closed"
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_concurrent_identical_reads_share_one_request():
+    async def run():
+        calls = 0
+
+        async def handler(request):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"value": 3})
+
+        store = await async_http_store(handler)
+        values = await asyncio.gather(*(store.get_counter("hits") for _ in range(10)))
+        other = await store.get_counter("other")
+        await store.close()
+        return values, other, calls, store.flight.shared
+
+    values, other, calls, shared = asyncio.run(run())
+    assert values == [3] * 10 and other == 3
+    assert calls == 2  # one for the ten "hits" reads, one for "other"
+    assert shared == 9
+
+
+def test_coalescing_also_shares_errors():
+    async def run():
+        calls = 0
+
+        async def handler(request):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return httpx.Response(500)
+
+        store = await async_http_store(handler)
+        results = await asyncio.gather(*(store.get_counter("hits") for _ in range(5)), return_exceptions=True)
+        await store.close()
+        return results, calls
+
+    results, calls = asyncio.run(run())
+    assert calls == 1
+    assert all(isinstance(r, httpx.HTTPStatusError) for r in results)
+
+
+def test_sync_coalescing_across_threads():
+    started = threading.Event()
+    release = threading.Event()
+    calls = 0
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        started.set()
+        release.wait(2)
+        return httpx.Response(200, json={"value": 5})
+
+    store = http_store(handler)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.get_counter("hits"))) for _ in range(4)]
+    threads[0].start()
+    started.wait(2)
+    for t in threads[1:]:
+        t.start()
+    # let the followers reach the shared call before the leader finishes
+    deadline = time.monotonic() + 2
+    while store.flight.shared < 3 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for t in threads:
+        t.join()
+    store.close()
+    assert results == [5] * 4 and calls == 1
+
+
+def test_retry_budget_spends_and_earns_tokens():
+    budget = main.RetryBudget(ratio=0.5, burst=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+
+
+def test_retries_are_skipped_once_the_budget_is_spent(monkeypatch):
+    monkeypatch.setattr(main, "HTTP_BREAKER_FAILURES", 0)
+    monkeypatch.setattr(main, "HTTP_READ_RETRIES", 3)
+    monkeypatch.setattr(main, "HTTP_RETRY_BUDGET", 0.0)
+    monkeypatch.setattr(main, "HTTP_RETRY_BURST", 1)
+    upstream = Upstream()
+    upstream.down = True
+    store = http_store(upstream)
+    with pytest.raises(httpx.HTTPStatusError):
+        store.get_counter("hits")
+    assert upstream.requests == 2  # the one token paid for one retry
+    with pytest.raises(httpx.HTTPStatusError):
+        store.get_counter("hits")
+    assert upstream.requests == 3
+    assert store.read_events["counter"] == {"read": 2, "retry": 1, "retry_skipped": 2}
+    store.close()
+
+
+@pytest.mark.parametrize(
+    "error, retried",
+    [(httpx.ReadTimeout, False), (httpx.ConnectError, True), (httpx.ConnectTimeout, True)],
+)
+def test_only_connect_errors_and_5xx_are_retried(monkeypatch, error, retried):
+    monkeypatch.setattr(main, "HTTP_BREAKER_FAILURES", 10)
+    monkeypatch.setattr(main, "HTTP_READ_RETRIES", 2)
+    calls = 0
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        raise error("upstream trouble", request=request)
+
+    store = http_store(handler)
+    with pytest.raises(error):
+        store.get_counter("hits")
+    assert calls == (3 if retried else 1)
+    # a read timeout is not retried but still counts against the breaker
+    assert store.breakers["counter"].failures == 1
+    store.close()
+
+
+def test_latency_window_needs_history_before_hedging(monkeypatch):
+    monkeypatch.setattr(main, "HTTP_HEDGE_MIN_MS", 10)
+    window = main.LatencyWindow()
+    for ms in range(1, 20):
+        window.add(ms / 1000.0)
+    assert window.hedge_delay() is None
+    window.add(0.020)
+    assert window.hedge_delay() == pytest.approx(0.019)
+    fast = main.LatencyWindow()
+    for _ in range(20):
+        fast.add(0.001)
+    assert fast.hedge_delay() == pytest.approx(0.010)  # never below APP_HTTP_HEDGE_MIN_MS
+
+
+class SlowThenFast:
+    """The n-th request sleeps delays[n] seconds and answers n + 1."""
+
+    def __init__(self, *delays: float) -> None:
+        self.delays = delays
+        self.arrivals = []
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        with self._lock:
+            n = len(self.arrivals)
+            self.arrivals.append(time.monotonic())
+        time.sleep(self.delays[n])
+        return httpx.Response(200, json={"value": n + 1})
+
+
+def hedging_store(monkeypatch, handler, p95: float) -> "main.HttpStore":
+    monkeypatch.setattr(main, "HTTP_HEDGE", True)
+    store = http_store(handler)
+    for _ in range(main.LatencyWindow.MIN_SAMPLES):
+        store.latency["counter"].add(p95)
+    return store
+
+
+def test_no_hedge_when_the_primary_answers_within_the_delay(monkeypatch):
+    upstream = SlowThenFast(0.0, 0.0)
+    store = hedging_store(monkeypatch, upstream, p95=0.05)
+    assert store.get_counter("hits") == 1
+    assert len(upstream.arrivals) == 1
+    assert "hedge" not in store.read_events["counter"]
+    store.close()
+
+
+def test_hedge_fires_after_the_p95_delay_and_the_first_answer_wins(monkeypatch):
+    upstream = SlowThenFast(0.5, 0.0)
+    store = hedging_store(monkeypatch, upstream, p95=0.05)
+    started = time.monotonic()
+    assert store.get_counter("hits") == 2
+    assert time.monotonic() - started < 0.4  # did not wait for the slow primary
+    assert len(upstream.arrivals) == 2
+    assert upstream.arrivals[1] - upstream.arrivals[0] >= 0.045
+    assert store.read_events["counter"]["hedge"] == 1
+    assert store.read_events["counter"]["hedge_won"] == 1
+    store.close()
+
+
+def test_primary_still_wins_when_the_hedge_is_slower(monkeypatch):
+    upstream = SlowThenFast(0.1, 0.5)
+    store = hedging_store(monkeypatch, upstream, p95=0.05)
+    assert store.get_counter("hits") == 1
+    assert store.read_events["counter"]["hedge"] == 1
+    assert "hedge_won" not in store.read_events["counter"]
+    store.close()
+
+
+def test_async_hedge_wins_and_the_loser_is_cancelled(monkeypatch):
+    monkeypatch.setattr(main, "HTTP_HEDGE", True)
+
+    async def run():
+        arrivals = []
+        cancelled = []
+
+        async def handler(request):
+            n = len(arrivals)
+            arrivals.append(time.monotonic())
+            try:
+                await asyncio.sleep(0.5 if n == 0 else 0.0)
+            except asyncio.CancelledError:
+                cancelled.append(n)
+                raise
+            return httpx.Response(200, json={"value": n + 1})
+
+        store = await async_http_store(handler)
+        for _ in range(main.LatencyWindow.MIN_SAMPLES):
+            store.latency["counter"].add(0.05)
+        value = await store.get_counter("hits")
+        await asyncio.sleep(0.01)
+        await store.close()
+        return value, arrivals, cancelled, store.read_events["counter"]
+
+    value, arrivals, cancelled, events = asyncio.run(run())
+    assert value == 2
+    assert arrivals[1] - arrivals[0] >= 0.045
+    assert cancelled == [0]
+    assert events["hedge"] == 1 and events["hedge_won"] == 1
@@ -0,0 +1,181 @@
+"""Behaviour every Store backend has to share: memory, SQLite and Redis
+(on fakeredis) run the same tests.
+
+Run from apps/course-app: python -m pytest -q tests
+"""
+import pytest
+
+import main
+
+
+def _redis_store(server=None) -> "main.RedisStore":
+    fakeredis = pytest.importorskip("fakeredis")
+    store = main.RedisStore("redis://localhost:6379/0")
+    store.client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    # the scripts were registered on the real client; bind them to the fake one
+    for attr, value in list(vars(store).items()):
+        if hasattr(value, "script"):
+            setattr(store, attr, store.client.register_script(value.script))
+    return store
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        s = main.MemoryStore(1000)
+    elif request.param == "sqlite":
+        s = main.SqliteStore(str(tmp_path / "app.db"))
+    else:
+        s = _redis_store()
+    s.init()
+    yield s
+    s.close()
+
+
+def ids(items):
+    return [it["id"] for it in items]
+
+
+def test_empty_store(store):
+    assert store.list_messages(limit=10) == []
+    assert store.list_messages(limit=10, before_id=5) == []
+    assert store.list_messages(limit=10, after_id=0) == []
+    assert store.get_counter("visits") == 0
+    assert store.get_counter("never-used") == 0
+
+
+def test_add_messages_returns_increasing_ids_in_input_order(store):
+    first = store.add_messages(["a", "b", "c"])
+    store.add_message("d")
+    second = store.add_messages(["e", "f"])
+    assert first == sorted(first) and len(set(first)) == 3
+    assert second == sorted(second) and second[0] > first[-1]
+    assert store.add_messages([]) == []
+    items = store.list_messages(limit=10)
+    assert [it["text"] for it in items] == ["f", "e", "d", "c", "b", "a"]
+    assert ids(items)[0] == second[-1]
+    assert all(it["created_at"] for it in items)
+
+
+def test_list_is_newest_first_and_limited(store):
+    added = store.add_messages([f"m{i}" for i in range(25)])
+    page = store.list_messages(limit=10)
+    assert ids(page) == added[::-1][:10]
+    assert ids(store.list_messages(limit=100)) == added[::-1]
+
+
+def test_before_id_pages_backwards_through_everything(store):
+    added = store.add_messages([f"m{i}" for i in range(25)])
+    seen, before = [], None
+    while True:
+        page = store.list_messages(limit=7, before_id=before)
+        if not page:
+            break
+        assert len(page) <= 7
+        seen += ids(page)
+        before = page[-1]["id"]
+    assert seen == added[::-1]
+    assert store.list_messages(limit=5, before_id=added[0]) == []
+    assert ids(store.list_messages(limit=3, before_id=added[10])) == added[7:10][::-1]
+
+
+def test_after_id_pages_forwards_through_everything(store):
+    added = store.add_messages([f"m{i}" for i in range(25)])
+    seen, after = [], 0
+    while True:
+        page = store.list_messages(limit=7, after_id=after)
+        if not page:
+            break
+        # each page holds the `limit` messages right after the cursor, newest first
+        assert ids(page) == sorted(ids(page), reverse=True)
+        seen += ids(page)[::-1]
+        after = page[0]["id"]
+    assert seen == added
+    assert store.list_messages(limit=5, after_id=added[-1]) == []
+    assert ids(store.list_messages(limit=3, after_id=added[10])) == added[11:14][::-1]
+
+
+def test_counters_with_deltas(store):
+    assert store.incr_counter("likes") == 1
+    assert store.incr_counter("likes", 5) == 6
+    assert store.incr_counter("likes", -2) == 4
+    assert store.get_counter("likes") == 4
+    assert store.incr_counters({"likes": 3, "shares": 2}) == {"likes": 7, "shares": 2}
+    assert store.get_counter("shares") == 2
+    assert store.incr_counter("visits") == 1
+    # names that look like the store's own bookkeeping are ordinary counters
+    assert store.incr_counter("shards", 2) == 2
+    assert store.get_counter("shards") == 2
+
+
+def test_sharded_counter_survives_shard_count_changes(store, monkeypatch):
+    monkeypatch.setattr(main, "COUNTER_SHARDS", {"hot": 8})
+    for _ in range(100):
+        store.incr_counter("hot")
+    store.incr_counters({"hot": 10})
+    assert store.get_counter("hot") == 110
+    monkeypatch.setattr(main, "COUNTER_SHARDS", {"hot": 2})
+    assert store.get_counter("hot") == 110
+    assert store.incr_counter("hot") == 111
+    monkeypatch.setattr(main, "COUNTER_SHARDS", {})
+    assert store.get_counter("hot") == 111
+    assert store.incr_counter("hot", 4) == 115
+
+
+def test_redis_reads_shards_another_pod_wrote(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    sharded = _redis_store(server)
+    monkeypatch.setattr(main, "COUNTER_SHARDS", {"hot": 8})
+    for _ in range(50):
+        sharded.incr_counter("hot")
+    # a pod started without APP_COUNTER_SHARDS still sums all eight shards
+    monkeypatch.setattr(main, "COUNTER_SHARDS", {})
+    plain = _redis_store(server)
+    assert plain.get_counter("hot") == 50
+    assert plain.incr_counter("hot") == 51
+
+
+def test_compaction_by_count_keeps_the_newest_in_batches(store):
+    added = store.add_messages([f"m{i}" for i in range(10)])
+    assert store.compact_messages(4, 0, 3) == 3
+    total = 3
+    while True:
+        n = store.compact_messages(4, 0, 3)
+        if not n:
+            break
+        total += n
+    assert total == 6
+    assert ids(store.list_messages(limit=100)) == added[6:][::-1]
+    assert ids(store.list_messages(limit=100, after_id=0)) == added[6:][::-1]
+    assert store.compact_messages(4, 0, 3) == 0
+    # new messages keep their own ids after a compaction
+    newer = store.add_messages(["n"])
+    assert newer[0] > added[-1]
+
+
+def test_compaction_by_age(store, monkeypatch):
+    added = store.add_messages([f"m{i}" for i in range(5)])
+    assert store.compact_messages(0, 3600, 100) == 0
+    # a cutoff after every created_at: everything is too old
+    monkeypatch.setattr(main, "_retention_cutoff", lambda max_age_s: "9999" if max_age_s > 0 else "")
+    assert store.compact_messages(0, 3600, 2) == 2
+    assert ids(store.list_messages(limit=10)) == added[2:][::-1]
+    assert store.compact_messages(0, 3600, 100) == 3
+    assert store.list_messages(limit=10) == []
+
+
+def test_compaction_without_limits_is_a_no_op(store):
+    store.add_messages(["a", "b"])
+    assert store.compact_messages(0, 0, 100) == 0
+    assert len(store.list_messages(limit=10)) == 2
+
+
+def test_search_finds_every_word_after_other_searches(store):
+    # regression: Redis used search:scratch as its scratch key, which is also the
+    # index of the word "scratch", and every search deleted it
+    added = store.add_messages(["start from scratch", "other words", "scratch that other idea"])
+    assert ids(store.search_messages("scratch")) and store.search_messages("words")
+    assert sorted(ids(store.search_messages("scratch"))) == [added[0], added[2]]
+    assert ids(store.search_messages("scratch other")) == [added[2]]
+    assert store.search_messages("missing") == []
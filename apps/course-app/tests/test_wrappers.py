@@ -0,0 +1,50 @@
+"""Async store wrappers: write-behind counters and the message page cache."""
+import asyncio
+
+import main
+
+
+class SlowCounters(main.InlineAsyncStore):
+    """Memory store whose batched increments take a while to land."""
+
+    def __init__(self) -> None:
+        super().__init__(main.MemoryStore(100))
+        self.started = asyncio.Event()
+
+    async def incr_counters(self, deltas):
+        self.started.set()
+        await asyncio.sleep(0.05)
+        return await super().incr_counters(deltas)
+
+
+def test_coalescing_close_keeps_the_batch_in_flight():
+    async def run():
+        inner = SlowCounters()
+        store = main.CoalescingCounterStore(inner, flush_ms=10_000, max_pending=3)
+        await store.init()
+        for _ in range(3):
+            await store.incr_counter("hits")
+        # the third increment woke the flush loop; shut down while it is writing
+        await inner.started.wait()
+        await store.incr_counter("hits", 10)
+        await store.close()
+        return await inner.get_counter("hits")
+
+    assert asyncio.run(run()) == 13
+
+
+def test_coalescing_reads_include_pending_deltas():
+    async def run():
+        inner = main.InlineAsyncStore(main.MemoryStore(100))
+        store = main.CoalescingCounterStore(inner, flush_ms=10_000, max_pending=1000)
+        await store.init()
+        assert await store.incr_counter("hits", 2) == 2
+        assert await store.incr_counter("hits", 3) == 5
+        assert await inner.get_counter("hits") == 0
+        assert await store.get_counter("hits") == 5
+        await store.flush()
+        assert await inner.get_counter("hits") == 5
+        await store.close()
+        return await inner.get_counter("hits")
+
+    assert asyncio.run(run()) == 5